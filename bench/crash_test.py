@@ -0,0 +1,101 @@
+"""Check the durability window of write-behind subscriber writes.
+
+Starts bot.py as a delivery worker against a stand-in Bot API, kills it
+with SIGKILL in the middle of a delivery round, starts it again and lets
+it finish, then stops it with SIGTERM:
+
+    python bench/crash_test.py --users 3000 --rate 500
+
+Users delivered to but not yet written when the process died get their
+word again after the restart; there should be at most WRITE_BEHIND_MAX
+plus BROADCAST_CONCURRENCY of them. After the SIGTERM every delivery must
+be in the store, since shutdown writes the buffer out.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from load_test import ROOT, generate_users
+from webhook_load import SENT_MESSAGES, start_fake_api
+
+
+async def start_bot(workdir, env):
+    return await asyncio.create_subprocess_exec(sys.executable, os.path.join(ROOT, "bot.py"), cwd=workdir, env=env)
+
+
+async def wait_for_messages(count, timeout):
+    deadline = time.monotonic() + timeout
+    while sum(SENT_MESSAGES.values()) < count and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+
+async def main(args):
+    runner = await start_fake_api(args.api_port)
+    try:
+        with tempfile.TemporaryDirectory(prefix="bot-crash-") as workdir:
+            os.symlink(os.path.join(ROOT, "wordlists"), os.path.join(workdir, "wordlists"))
+            generate_users(os.path.join(workdir, "users.json"), args.users)
+            env = dict(
+                os.environ,
+                BOT_TOKEN="123456:CRASHTEST",
+                BOT_API_URL=f"http://127.0.0.1:{args.api_port}",
+                BOT_ROLE="delivery",
+                SHARDS="1",
+                DELIVERY_MODE="batched",  # one message per delivery
+                USER_STORE="sqlite:users.db",
+                BROADCAST_RATE=str(args.rate),
+                BROADCAST_CHAT_INTERVAL="0",
+                BROADCAST_CONCURRENCY=str(args.concurrency),
+                WRITE_BEHIND_MAX=str(args.write_behind_max),
+                LOG_LEVEL="WARNING",
+            )
+            env.pop("METRICS_PORT", None)
+
+            bot = await start_bot(workdir, env)
+            await wait_for_messages(args.users * args.kill_at, timeout=60)
+            if bot.returncode is not None:
+                print(f"bot.py exited early with code {bot.returncode}")
+                return 1
+            bot.send_signal(signal.SIGKILL)
+            await bot.wait()
+            before_restart = sum(SENT_MESSAGES.values())
+            print(f"Killed after {before_restart} of {args.users} deliveries")
+
+            bot = await start_bot(workdir, env)
+            await wait_for_messages(args.users + args.write_behind_max + args.concurrency, timeout=args.timeout)
+            await asyncio.sleep(1)  # let stray duplicates arrive
+            bot.send_signal(signal.SIGTERM)
+            exit_code = await bot.wait()
+
+            sys.path.insert(0, ROOT)
+            from user_store import open_user_store
+            store = open_user_store(f"sqlite:{os.path.join(workdir, 'users.db')}")
+            recent = datetime.now(timezone.utc) - timedelta(hours=1)
+            unsaved = sum(1 for when in store.load()["active_users"].values() if when is None or when < recent)
+            store.close()
+    finally:
+        await runner.cleanup()
+
+    missing = args.users - len(SENT_MESSAGES)
+    duplicates = sum(count - 1 for count in SENT_MESSAGES.values() if count > 1)
+    bound = args.write_behind_max + args.concurrency
+    print(f"Delivered {len(SENT_MESSAGES)}/{args.users} users, {duplicates} duplicates (bound {bound}), "
+          f"{unsaved} deliveries not in the store after SIGTERM, exit code {exit_code}")
+    return 0 if not missing and duplicates <= bound and not unsaved else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=3000)
+    parser.add_argument("--rate", type=float, default=500, help="broadcast messages/s")
+    parser.add_argument("--concurrency", type=int, default=25, help="broadcast workers")
+    parser.add_argument("--write-behind-max", type=int, default=500)
+    parser.add_argument("--kill-at", type=float, default=0.5, help="fraction of deliveries before SIGKILL")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--api-port", type=int, default=8084)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,201 @@
+"""End-to-end load test of bot.py against a stand-in Bot API.
+
+For every population size a fresh users.json is generated and a child
+process imports bot.py against it, with `BOT_API_URL` pointing at the
+stand-in Bot API served by this process. The child
+
+* replays /start, /skip, /addlist and /list traffic from virtual users
+  through the dispatcher, and
+* runs `send_daily_word` rounds over every subscriber,
+
+then reports throughput, latency percentiles and its peak RSS:
+
+    python bench/load_test.py --users 1000,10000,100000 --updates 5000
+    python bench/load_test.py --users 1000000 --updates 0 --store json
+
+Broadcast rate limits are lifted (BROADCAST_RATE, BROADCAST_CHAT_INTERVAL)
+so rounds measure the bot itself rather than Telegram's 30 messages/s, and
+so are the per-user update limits (THROTTLE_RATE, THROTTLE_BURST,
+SKIP_COOLDOWN) so replayed commands reach their handlers instead of being
+dropped.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from webhook_load import make_update, percentile, start_fake_api
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LISTS = ["swear", "fenia", "international-swear"]
+TRAFFIC = ["/start", "/skip", "/addlist international-swear", "/list fenia", "/list international-swear английский 2"]
+
+
+def generate_users(path, count, seed=0):
+    """Write a users.json with `count` subscribers whose next word is due"""
+    rng = random.Random(seed)
+    due = datetime.now(timezone.utc) - timedelta(hours=25)
+    active_users = {}
+    user_lists = {}
+    for user_id in range(1, count + 1):
+        active_users[str(user_id)] = (due - timedelta(seconds=rng.randrange(3600))).isoformat()
+        if rng.random() < 0.3:
+            user_lists[str(user_id)] = rng.sample(LISTS, rng.randint(1, len(LISTS)))
+    with open(path, "w") as file:
+        json.dump({"version": 2, "active_users": active_users, "user_lists": user_lists}, file)
+
+
+def summarize(samples):
+    if not samples:
+        return {}
+    return {"p50": percentile(samples, 0.5), "p90": percentile(samples, 0.9), "p99": percentile(samples, 0.99),
+            "max": max(samples)}
+
+
+def peak_rss_mb():
+    import resource
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+async def replay_traffic(bot_module, updates, virtual_users, population):
+    """Feed `updates` synthetic updates from `virtual_users` concurrent users"""
+    from aiogram.types import Update
+
+    update_ids = iter(range(1, updates + 1))
+    latencies = []
+
+    async def virtual_user(user_id):
+        for update_id in update_ids:
+            update = Update.model_validate(make_update(update_id, user_id, random.choice(TRAFFIC)))
+            started = time.perf_counter()
+            await bot_module.dp.feed_update(bot_module.bot, update)
+            latencies.append(time.perf_counter() - started)
+
+    # Half known subscribers, half new users
+    user_ids = [random.randint(1, population) if i % 2 else population + i for i in range(virtual_users)]
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_user(user_id) for user_id in user_ids))
+    return time.perf_counter() - started, latencies
+
+
+async def delivery_round(bot_module):
+    """Run send_daily_word over every subscriber, timing each user's delivery"""
+    latencies = []
+    send_word_to_user = bot_module.send_word_to_user
+
+    async def timed(user_id, force=False):
+        started = time.perf_counter()
+        try:
+            return await send_word_to_user(user_id, force)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    bot_module.send_word_to_user = timed
+    try:
+        user_ids = list(bot_module.subscribers.active_user_ids())
+        started = time.perf_counter()
+        await bot_module.send_daily_word(user_ids)
+        return time.perf_counter() - started, latencies
+    finally:
+        bot_module.send_word_to_user = send_word_to_user
+
+
+async def run_child(args):
+    started = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    import bot as bot_module
+    bot_module.open_subscribers()
+    result = {"users": args.population, "startup": time.perf_counter() - started}
+
+    if args.updates:
+        elapsed, latencies = await replay_traffic(bot_module, args.updates, args.virtual_users, args.population)
+        result["traffic"] = {"updates": len(latencies), "elapsed": elapsed, **summarize(latencies)}
+
+    result["rounds"] = []
+    for _ in range(args.rounds):
+        elapsed, latencies = await delivery_round(bot_module)
+        result["rounds"].append({"delivered": len(latencies), "elapsed": elapsed, **summarize(latencies)})
+
+    await bot_module.bot.session.close()
+    result["peak_rss_mb"] = peak_rss_mb()
+    print("RESULT " + json.dumps(result))
+
+
+def report(result):
+    print(f"\n{result['users']} users: startup {result['startup']:.2f}s, peak RSS {result['peak_rss_mb']:.0f} MB")
+    traffic = result.get("traffic")
+    if traffic:
+        print(f"  traffic: {traffic['updates']} updates in {traffic['elapsed']:.2f}s "
+              f"({traffic['updates'] / traffic['elapsed']:.0f}/s), latency p50={traffic['p50'] * 1000:.2f}ms "
+              f"p90={traffic['p90'] * 1000:.2f}ms p99={traffic['p99'] * 1000:.2f}ms")
+    for number, round_ in enumerate(result["rounds"], 1):
+        if not round_["delivered"]:
+            print(f"  round {number}: nothing to deliver")
+            continue
+        print(f"  round {number}: {round_['delivered']} users in {round_['elapsed']:.2f}s "
+              f"({round_['delivered'] / round_['elapsed']:.0f}/s), per-user p50={round_['p50'] * 1000:.2f}ms "
+              f"p99={round_['p99'] * 1000:.2f}ms max={round_['max'] * 1000:.2f}ms")
+
+
+async def main(args):
+    runner = await start_fake_api(args.api_port)
+    try:
+        for population in (int(size) for size in args.users.split(",")):
+            with tempfile.TemporaryDirectory(prefix="bot-load-") as workdir:
+                os.symlink(os.path.join(ROOT, "wordlists"), os.path.join(workdir, "wordlists"))
+                started = time.perf_counter()
+                generate_users(os.path.join(workdir, "users.json"), population)
+                print(f"Generated {population} users in {time.perf_counter() - started:.1f}s", flush=True)
+
+                env = dict(
+                    os.environ,
+                    BOT_TOKEN="123456:LOADTEST",
+                    BOT_API_URL=f"http://127.0.0.1:{args.api_port}",
+                    USER_STORE="json:users.json" if args.store == "json" else "sqlite:users.db",
+                    BROADCAST_RATE=str(args.rate),
+                    BROADCAST_CHAT_INTERVAL="0",
+                    BROADCAST_CONCURRENCY=str(args.concurrency),
+                    THROTTLE_RATE="1000000",
+                    THROTTLE_BURST="1000000",
+                    SKIP_COOLDOWN="0",
+                    LOG_LEVEL="WARNING",
+                )
+                env.pop("METRICS_PORT", None)
+                child = await asyncio.create_subprocess_exec(
+                    sys.executable, os.path.abspath(__file__), "--child",
+                    "--population", str(population), "--updates", str(args.updates),
+                    "--virtual-users", str(args.virtual_users), "--rounds", str(args.rounds),
+                    cwd=workdir, env=env, stdout=subprocess.PIPE,
+                )
+                output, _ = await child.communicate()
+                lines = [line for line in output.decode().splitlines() if line.startswith("RESULT ")]
+                if child.returncode or not lines:
+                    print(f"{population} users: run failed (exit code {child.returncode})")
+                    continue
+                report(json.loads(lines[-1][len("RESULT "):]))
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", default="1000,10000,100000", help="comma-separated subscriber counts")
+    parser.add_argument("--updates", type=int, default=2000, help="synthetic updates to replay, 0 to skip")
+    parser.add_argument("--virtual-users", type=int, default=100, help="concurrent users sending updates")
+    parser.add_argument("--rounds", type=int, default=1, help="send_daily_word rounds over all subscribers")
+    parser.add_argument("--store", choices=("sqlite", "json"), default="sqlite")
+    parser.add_argument("--rate", type=float, default=1e6, help="broadcast messages/s")
+    parser.add_argument("--concurrency", type=int, default=100, help="broadcast workers")
+    parser.add_argument("--api-port", type=int, default=8082)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--population", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    asyncio.run(run_child(args) if args.child else main(args))
@@ -0,0 +1,56 @@
+"""Serve saved matno.ru board pages locally for parser-matnoru.py.
+
+Fixtures are files named page<N>.html in a directory; a request for
+/board/?page<N> returns page<N>.html with an ETag and Last-Modified, and
+honours If-None-Match / If-Modified-Since with 304 responses. tests/fixtures
+holds a one-page board covering the markup the parser backends must agree on.
+
+    python bench/matno_stub.py tests/fixtures/ --port 8090
+    python parser-matnoru.py --base-url http://127.0.0.1:8090/board/ --pages 1 --delay 0
+"""
+import argparse
+import hashlib
+import os
+from email.utils import formatdate
+
+from aiohttp import web
+
+
+def make_app(fixtures_dir, fail_pages=()):
+    stats = {'requests': 0, 'not_modified': 0}
+
+    async def board(request):
+        stats['requests'] += 1
+        page = request.query_string.replace('page', '') or '1'
+        if page in fail_pages:
+            return web.Response(status=500)
+        path = os.path.join(fixtures_dir, f"page{page}.html")
+        if not os.path.exists(path):
+            return web.Response(status=404)
+
+        with open(path, 'rb') as file:
+            body = file.read()
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        last_modified = formatdate(os.path.getmtime(path), usegmt=True)
+        headers = {'ETag': etag, 'Last-Modified': last_modified}
+        if request.headers.get('If-None-Match') == etag or request.headers.get('If-Modified-Since') == last_modified:
+            stats['not_modified'] += 1
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, content_type='text/html', charset='utf-8', headers=headers)
+
+    async def show_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_get('/board/', board)
+    app.router.add_get('/stats', show_stats)
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('fixtures_dir')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--fail-pages', default='', help="comma-separated pages that answer 500")
+    args = parser.parse_args()
+    web.run_app(make_app(args.fixtures_dir, set(filter(None, args.fail_pages.split(',')))), port=args.port)
@@ -0,0 +1,65 @@
+"""Benchmark matno.ru parser backends over saved pages.
+
+Parses every *.html file in a directory (the scraper's cache directory or
+a fixtures directory) with each installed backend, checks that the
+formatted word list matches the reference `html.parser` output, and
+reports pages per second.
+
+    python bench/parse_bench.py .cache/matno
+    python bench/parse_bench.py tests/fixtures
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matno_parse import available_backends, format_blocks_to_strings, parse_html_blocks  # noqa: E402
+
+
+def parse_all(pages, backend):
+    blocks = []
+    for html in pages:
+        blocks.extend(parse_html_blocks(html, backend))
+    return blocks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pages_dir')
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per backend, the best one is reported")
+    args = parser.parse_args()
+
+    pages = []
+    for path in sorted(glob.glob(os.path.join(args.pages_dir, '*.html'))):
+        with open(path, 'r', encoding='utf-8') as file:
+            pages.append(file.read())
+    if not pages:
+        sys.exit(f"No .html files in {args.pages_dir}")
+
+    reference_blocks = parse_all(pages, 'html.parser')
+    reference = format_blocks_to_strings(reference_blocks)
+    print(f"{len(pages)} pages, {len(reference_blocks)} entries, {len(reference)} formatted lines")
+
+    mismatches = 0
+    for backend in available_backends():
+        best = None
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            blocks = parse_all(pages, backend)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        same_lines = format_blocks_to_strings(blocks) == reference
+        same_blocks = blocks == reference_blocks
+        mismatches += not same_lines
+        print(f"{backend:12} {len(pages) / best:10.1f} pages/s  "
+              f"output {'identical' if same_lines else 'DIFFERS'}"
+              f"{'' if same_blocks else ' (some block fields differ)'}")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Post synthetic Telegram updates to a bot running in webhook mode.
+
+Start the bot against the stand-in Bot API this script serves:
+
+    BOT_MODE=webhook WEBHOOK_SECRET=test BOT_API_URL=http://127.0.0.1:8081 \\
+    THROTTLE_RATE=1000000 THROTTLE_BURST=1000000 SKIP_COOLDOWN=0 \\
+    BOT_TOKEN=123456:TEST python bot.py
+
+then run:
+
+    python bench/webhook_load.py --secret test --updates 5000 --users 500
+
+Reports request latency and the bot's own handler latency percentiles.
+
+The THROTTLE_* and SKIP_COOLDOWN settings lift the per-user update limits,
+otherwise most of the replayed commands are dropped before their handlers.
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter
+
+from aiohttp import ClientSession, web
+
+COMMANDS = ["/start", "/skip", "/lists", "/list", "/addlist international-swear", "hello"]
+SENT_MESSAGES = Counter()  # chat id -> sendMessage calls answered by the stand-in API
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else None
+
+
+def make_update(update_id, user_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+            if text.startswith("/") else [],
+        },
+    }
+
+
+async def fake_bot_api(request):
+    """Answer every Bot API method with a plausible successful result"""
+    data = await request.post()
+    method = request.match_info["method"]
+    if method == "getMe":
+        result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+    elif method in ("sendMessage", "editMessageText"):
+        chat_id = int(data.get("chat_id", 1))
+        if method == "sendMessage":
+            SENT_MESSAGES[chat_id] += 1
+        result = {
+            "message_id": random.randint(1, 1 << 30),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": data.get("text", ""),
+        }
+    else:
+        result = True
+    return web.json_response({"ok": True, "result": result})
+
+
+async def start_fake_api(port):
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", fake_bot_api)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def main(args):
+    runner = await start_fake_api(args.api_port) if args.api_port else None
+    update_ids = itertools.count(1)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret}
+    latencies = []
+    statuses = {}
+
+    async with ClientSession() as session:
+        async def post_updates(count):
+            for _ in range(count):
+                update = make_update(next(update_ids), random.randint(1, args.users), random.choice(COMMANDS))
+                started = time.perf_counter()
+                async with session.post(args.url, json=update, headers=headers) as response:
+                    await response.read()
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        per_client = args.updates // args.concurrency
+        await asyncio.gather(*(post_updates(per_client) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+        await asyncio.sleep(args.settle)
+        async with session.get(f"{args.url}/stats", headers=headers) as response:
+            stats = await response.json()
+
+    print(f"Posted {len(latencies)} updates in {elapsed:.2f}s ({len(latencies) / elapsed:.0f}/s), statuses: {statuses}")
+    print(f"Request latency p50={percentile(latencies, 0.5) * 1000:.2f}ms p99={percentile(latencies, 0.99) * 1000:.2f}ms")
+    if stats.get("p50") is not None:
+        print(f"Handler latency p50={stats['p50'] * 1000:.2f}ms p99={stats['p99'] * 1000:.2f}ms "
+              f"(handled {stats['handled']}, still queued {stats['queued']})")
+
+    if runner:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", required=True)
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--api-port", type=int, default=8081, help="port for the stand-in Bot API, 0 to disable")
+    parser.add_argument("--settle", type=float, default=2.0, help="seconds to wait before reading handler stats")
+    asyncio.run(main(parser.parse_args()))
@@ -1,26 +1,60 @@
 import asyncio
+import functools
 import logging
-import random
-import json
 import os
-from datetime import datetime, timedelta
+import signal
+import socket
+import sys
+from datetime import date, datetime, timedelta, timezone
 import time
 import pytz
-from aiogram import Bot, Dispatcher, types
+from aiogram import Bot, Dispatcher, F, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.utils.token import TokenValidationError
 from aiogram.filters import Command, CommandObject
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from aiogram.types import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+)
 from dotenv import load_dotenv
 
+from broadcast import DEFERRED, INACTIVE, PERMANENT_RESULTS, SENT, Broadcaster, split_message
+from entries import language_key
+from leases import ShardLeases, shard_of
+from metrics import HANDLER_SECONDS, USERS_SERVED, mark_startup, serve as serve_metrics
+from scheduler import DeliveryScheduler, find_timezone, format_schedule, next_local_time, parse_schedule, parse_time_of_day
+from stats import DELIVERED, SKIPPED, SUBSCRIBED, UNSUBSCRIBED, StatsLog
+from subscribers import SubscriberRegistry
+from throttle import ThrottlingMiddleware, UserThrottle
+from user_store import check_user_store, open_user_store, parse_store_spec
+from wordlists import WordListRegistry
+
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging; DEBUG adds per-user and per-update detail, keep it off on busy deployments
+logging.basicConfig(
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+    format='%(asctime)s %(levelname)s %(name)s %(message)s',
+)
+if not logging.getLogger().isEnabledFor(logging.DEBUG):
+    # aiogram logs every handled update at INFO
+    logging.getLogger('aiogram.event').setLevel(logging.WARNING)
 
 # Initialize bot and dispatcher
 token = os.getenv('BOT_TOKEN')
-print(f"Debug - Token read from .env: {token}")
-bot = Bot(token=token)
+BOT_API_URL = os.getenv('BOT_API_URL')  # Optional local Bot API server or test stand-in
+try:
+    if BOT_API_URL:
+        bot = Bot(token=token, session=AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL)))
+    else:
+        bot = Bot(token=token)
+except TokenValidationError:
+    raise SystemExit("BOT_TOKEN is not set or malformed")
 dp = Dispatcher()
 
 # Constants
@@ -28,230 +62,408 @@ WORDLISTS_DIR = "wordlists"
 DEFAULT_WORDLIST = ["swear", "fenia"]
 # SEND_INTERVAL = timedelta(minutes=10)  # Define the interval for sending new messages
 SEND_INTERVAL = timedelta(hours=24)  # Define the interval for sending new messages
-moscow_tz = pytz.timezone('Europe/Moscow')
+DELIVERY_MODE = os.getenv('DELIVERY_MODE', 'per_list')  # 'per_list' or 'batched' (one message per user)
+BOT_MODE = os.getenv('BOT_MODE', 'polling')  # 'polling' or 'webhook'
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Public base URL registered with Telegram, if any
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '8'))
+LIST_PAGE_SIZE = 10  # Words per /list page
+LIST_ENTRY_LIMIT = 300  # Long entries are cut so a page always fits in one message
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # /metrics endpoint, 0 disables it
+RESPONSE_CACHE_SIZE = 1024  # Rendered responses kept per template, mostly one per distinct set of active lists
+THROTTLE_RATE = float(os.getenv('THROTTLE_RATE', '1'))  # Sustained updates/s per user
+THROTTLE_BURST = int(os.getenv('THROTTLE_BURST', '5'))
+SKIP_COOLDOWN = float(os.getenv('SKIP_COOLDOWN', '30'))  # Seconds between /skip, each sends a message per list
+FIND_LIMIT = 20  # Results shown by /find and inline queries
+RETRY_DELAY = timedelta(minutes=10)  # Retry interval after a transient delivery failure
+default_tz = pytz.timezone(os.getenv('DEFAULT_TIMEZONE', 'Europe/Moscow'))  # For users without /time
+USER_STORE = os.getenv('USER_STORE', 'sqlite:users.db')  # or 'json:users.json'
+BOT_ROLE = os.getenv('BOT_ROLE', 'all')  # 'all', 'updates' (answer users only) or 'delivery' (scheduled words only)
+SHARDS = int(os.getenv('SHARDS', '0'))  # >0 splits scheduled delivery between processes sharing the sqlite store
+LEASE_TTL = float(os.getenv('LEASE_TTL', '30'))  # Seconds before a dead worker's shards are taken over
+WRITE_BEHIND_MAX = int(os.getenv('WRITE_BEHIND_MAX', '500'))  # Changed users buffered before a batch write, 0 writes each at once
+WRITE_BEHIND_DELAY = float(os.getenv('WRITE_BEHIND_DELAY', '1.0'))  # Max seconds a change waits in the buffer
+STATS_STORE = os.getenv('STATS_STORE', 'stats.db')  # SQLite file for engagement statistics
+STATS_REPORT_DAYS = 7  # Days covered by the admin /stats report
+STATS_TOP_WORDS = 10
+ADMIN_IDS = {int(user_id) for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()}  # May use /stats all
+
+if (SHARDS or BOT_ROLE != 'all') and not (SHARDS and USER_STORE.startswith('sqlite:')):
+    raise SystemExit("BOT_ROLE and SHARDS need SHARDS > 0 and a sqlite USER_STORE shared by all processes")
+
+wordlists = WordListRegistry(WORDLISTS_DIR, use_packs=os.getenv('WORDLIST_PACKS', '1') == '1')
 
 
 def get_available_wordlists():
     """Get list of available word list files"""
-    try:
-        files = os.listdir(WORDLISTS_DIR)
-        return [f.replace('.txt', '') for f in files if f.endswith('.txt')]
-    except Exception as e:
-        logging.error(f"Error reading wordlists directory: {e}")
-        return []
+    return list(wordlists.names())
 
-def load_words(list_names=DEFAULT_WORDLIST):
-    """Load words from specified word list files"""
-    words = []
-    for list_name in list_names:
-        try:
-            file_path = os.path.join(WORDLISTS_DIR, f"{list_name}.txt")
-            with open(file_path, 'r', encoding='utf-8') as file:
-                list_words = [word.strip() for word in file if word.strip()]
-                print(f"List words: {len(list_words)}")
-                if not list_words:
-                    raise ValueError(f"Word list '{list_name}' is empty")
-                words.extend(list_words)  # Add the list of words to the total without shuffling
-        except FileNotFoundError:
-            logging.error(f"Word list '{list_name}' not found!")
-            if list_name != DEFAULT_WORDLIST:
-                continue  # Skip if it's not the default list
-        except Exception as e:
-            logging.error(f"Error reading word list '{list_name}': {e}")
-    
-    return words if words else ["default_word"]  # Return a default word if no words found
 
-def load_users():
-    """Load users from users.json file"""
-    try:
-        with open('users.json', 'r') as file:
-            data = json.load(file)
-            users = {}
-            user_lists = {}
-            
-            # Convert stored user data
-            for user_id, last_word_time in data.get('active_users', {}).items():
-                users[int(user_id)] = datetime.fromisoformat(last_word_time) if last_word_time else None
-            
-            # Load user list preferences
-            for user_id, lists in data.get('user_lists', {}).items():
-                user_lists[int(user_id)] = lists
+def cached_on_wordlists(render):
+    """Memoize a response renderer until the word lists change.
 
-            # Debug print
-            print(f"Loaded users: {users}")
-            print(f"Loaded user_lists: {user_lists}")
-            
-            return users, user_lists
-    except FileNotFoundError:
-        logging.warning("users.json not found, creating new file")
-        save_users({}, {})
-        return {}, {}
-    except Exception as e:
-        logging.error(f"Error loading users.json: {e}")
-        return {}, {}
+    Results are keyed on the call arguments and dropped whenever the
+    registry version moves, i.e. a file in wordlists/ was added, changed
+    or removed.
+    """
+    cache = {}
+    cached_version = [None]
 
-def save_users(users, user_lists):
-    """Save users to users.json file"""
-    try:
-        # Convert user IDs to strings for JSON serialization
-        serializable_users = {
-            str(user_id): user_time.isoformat() if user_time else None
-            for user_id, user_time in users.items()
-        }
-        
-        # Convert user IDs to strings for user lists
-        serializable_lists = {
-            str(user_id): lists
-            for user_id, lists in user_lists.items()
-        }
-        
-        data = {
-            'active_users': serializable_users,
-            'user_lists': serializable_lists,
-            'version': 2
-        }
-        
-        # Debug print before saving
-        print(f"About to save data: {data}")
-        
-        with open('users.json', 'w') as file:
-            json.dump(data, file, indent=4)
-            
-        # Verify the save
-        with open('users.json', 'r') as file:
-            saved_data = json.load(file)
-            print(f"Verified saved data: {saved_data}")
-            
-        return True
-    except Exception as e:
-        logging.error(f"Error saving users.json: {e}")
+    @functools.wraps(render)
+    def cached(*args):
+        wordlists.refresh()
+        if cached_version[0] != wordlists.version or len(cache) >= RESPONSE_CACHE_SIZE:
+            cache.clear()
+            cached_version[0] = wordlists.version
+        text = cache.get(args)
+        if text is None:
+            text = cache[args] = render(*args)
+        return text
+
+    return cached
+
+
+@cached_on_wordlists
+def list_bullets():
+    """{list name: (bullet, bullet marked active)} in sorted order"""
+    return {name: (f"• {name}", f"• {name} (active)") for name in wordlists.names()}
+
+
+@cached_on_wordlists
+def available_lists_inline():
+    return ", ".join(wordlists.names())
+
+
+@cached_on_wordlists
+def help_text():
+    available_lists_text = "\n".join(bullet for bullet, _ in list_bullets().values())
+    return (
+        "Available commands:\n"
+        "/stop - Unsubscribe from daily words\n"
+        "/skip - Get new words immediately\n"
+        "/time HH:MM [timezone] - Choose when you get your words\n"
+        "/lists - Show your active lists\n"
+        "/addlist <name> - Add a list\n"
+        "/remlist <name> - Remove a list\n"
+        "/list - Show words in current list\n"
+        "/list <name> [language] - Show a list, optionally one language only\n"
+        "/languages <name> - Show the languages of a list\n"
+        "/find <query> - Search your lists\n"
+        "/stats - Show how many words you got\n\n"
+        "Available lists\n"
+        f"{available_lists_text}\n"
+        "Use /addlist <list_name> to add a list.\n"
+        "Use /remlist <list_name> to remove a list."
+    )
+
+
+@cached_on_wordlists
+def welcome_text():
+    return (
+        "Hello! I'm your Daily Word Bot. 📚\n"
+        "You'll receive words from your selected lists every 24 hours.\n"
+        f"{help_text()}"
+    )
+
+
+@cached_on_wordlists
+def my_lists_text(selected_lists):
+    """/lists response for a user with these active lists"""
+    bullets = list_bullets()
+    active_text = "\n".join(bullets[lst][0] if lst in bullets else f"• {lst}" for lst in sorted(selected_lists))
+    available_text = "\n".join(bullet for lst, (bullet, _) in bullets.items() if lst not in selected_lists)
+
+    response = f"📚 Your active lists:\n{active_text}\n"
+    if available_text:
+        response += f"\nAvailable lists:\n{available_text}"
+    return (
+        f"{response}\n\n"
+        "Commands:\n"
+        "/addlist <name> - Add a list\n"
+        "/remlist <name> - Remove a list"
+    )
+
+
+@cached_on_wordlists
+def add_list_help_text(selected_lists):
+    """/addlist reply without a list name, marking the user's active lists"""
+    available_text = "\n".join(
+        active_bullet if lst in selected_lists else bullet
+        for lst, (bullet, active_bullet) in list_bullets().items()
+    )
+    return (
+        "Please provide a list name.\n"
+        f"Available lists:\n{available_text}\n\n"
+        "Usage: /addlist <name>"
+    )
+
+
+# Store active users with their last word times and list preferences, filled by load_subscribers()
+subscribers = SubscriberRegistry(None, DEFAULT_WORDLIST, WRITE_BEHIND_MAX, WRITE_BEHIND_DELAY)
+shard_leases = None  # Taken in main() when SHARDS is set
+stats = StatsLog(STATS_STORE, max_delay=WRITE_BEHIND_DELAY)  # Always buffered, delivery never waits on it
+
+
+def open_subscribers():
+    """Open the user store and read every subscriber into memory"""
+    subscribers.load(open_user_store(USER_STORE, legacy_json='users.json'))
+
+
+async def load_subscribers():
+    """Read subscribers in a worker thread, then queue their deliveries"""
+    await asyncio.to_thread(open_subscribers)
+    for user_id in subscribers.active_user_ids():
+        reschedule_user(user_id)
+    logging.info(f"Subscribers loaded {mark_startup('state_loaded'):.2f}s after start")
+
+def delivers_to(user_id):
+    """Whether this process sends the user's scheduled words"""
+    if BOT_ROLE == 'updates':
         return False
+    return shard_leases is None or shard_leases.holds_user(user_id)
 
-# Store active users with their last word times and list preferences
-def load_active_users_and_lists():
-    active_users, user_lists = load_users()
-    return active_users, user_lists
+def user_timezone(user_id):
+    schedule = parse_schedule(subscribers.schedule_for(user_id))
+    return schedule[1] if schedule else default_tz
 
-active_users, user_lists = load_active_users_and_lists()
 
-# Load default word list
-current_list_name = DEFAULT_WORDLIST
-WORD_LIST = load_words(current_list_name)
+def next_due_time(user_id):
+    """Epoch time at which the user should get their next words.
 
-async def should_send_word(user_id):
-    """Check if it's time to send a new word to the user"""
-    last_time = active_users.get(user_id)
+    Users with a /time preference get them at the first occurrence of that
+    local time after their last words, everyone else SEND_INTERVAL later.
+    """
+    last_time = subscribers.last_word_time(user_id)
+    schedule = parse_schedule(subscribers.schedule_for(user_id))
+    if schedule is not None:
+        minute_of_day, tz = schedule
+        return next_local_time(minute_of_day, tz, last_time or datetime.now(timezone.utc)).timestamp()
     if last_time is None:
-        return True
-    
-    now = datetime.now(moscow_tz)
-    print(f"Debug - now: {now}, last_time: {last_time}, SEND_INTERVAL: {SEND_INTERVAL}")
-    print(f"{(now - last_time) >= SEND_INTERVAL}")
-    return (now - last_time) >= SEND_INTERVAL
+        return time.time()
+    return (last_time + SEND_INTERVAL).timestamp()
+
+
+def reschedule_user(user_id):
+    """Keep the delivery queue in sync with the user's subscription state"""
+    if subscribers.is_active(user_id) and delivers_to(user_id):
+        delivery_scheduler.schedule(user_id, next_due_time(user_id))
+    else:
+        delivery_scheduler.cancel(user_id)
+
+def pick_words(user_id):
+    """Pick the user's next unseen entry from each of their lists as (list_name, record) pairs"""
+    picks = []
+    for list_name in subscribers.lists_for(user_id):
+        word_list = wordlists.get(list_name)
+        if word_list is None or not len(word_list):
+            logging.error(f"Word list '{list_name}' for {user_id} is missing or empty")
+            continue
+        index = subscribers.next_word_index(user_id, list_name, len(word_list))
+        picks.append((list_name, word_list.record(index)))
+    return picks
+
+
+def render_entry(record):
+    """Render a structured entry: the headword in bold, then its other fields"""
+    headword, pronunciation, definition, language = record
+    lines = [f"✨ *{headword}*"]
+    if pronunciation:
+        lines.append(f"🗣 {pronunciation}")
+    if definition:
+        lines.append(f"📖 {definition}")
+    if language:
+        lines.append(f"🌍 {language}")
+    return "\n".join(lines)
+
+
+def render_word_messages(user_id, picks, current_time):
+    """Render the user's picked words as messages according to DELIVERY_MODE"""
+    sent_at = current_time.astimezone(user_timezone(user_id)).strftime('%H:%M:%S')
+    if DELIVERY_MODE == 'batched' and picks:
+        sections = [f"🎯 Your words ({sent_at}):"]
+        sections.extend(f"📚 {list_name}\n{render_entry(record)}" for list_name, record in picks)
+        return split_message(sections)
+    return [
+        f"🎯 Your word from '{list_name}' ({sent_at}):\n\n{render_entry(record)}"
+        for list_name, record in picks
+    ]
+
 
 async def send_word_to_user(user_id, force=False):
-    """Send random words from user's selected lists"""
-    active_users, user_lists = load_active_users_and_lists()
-    print(f"Debug - send_word_to_user called with user_id: {user_id}, force: {force}")
-    if user_id not in active_users:
-        active_users[user_id] = None
-        user_lists.setdefault(user_id, DEFAULT_WORDLIST)
-        save_users(active_users, user_lists)
-
-    selected_lists = user_lists.get(user_id, DEFAULT_WORDLIST)
-    current_time = datetime.now(moscow_tz)
-    success = False
-    
-    for list_name in selected_lists:
+    """Send random words from user's selected lists, returns a delivery result"""
+    logging.debug("send_word_to_user user=%s force=%s", user_id, force)
+    current_time = datetime.now(timezone.utc)
+    picks = pick_words(user_id)
+    messages = render_word_messages(user_id, picks, current_time)
+    result = await broadcaster.send_messages(user_id, messages, parse_mode="Markdown")
+    if result == SENT:
+        subscribers.mark_sent(user_id, current_time)
+        for list_name, record in picks:
+            stats.record(SKIPPED if force else DELIVERED, user_id, list_name, record[0])
+        
+    return result
+
+async def send_daily_word(user_ids):
+    """Send random words to the users whose next delivery is due"""
+    if SHARDS:
+        # Pick up /stop, /skip and list changes the updates process made since the last sync;
+        # users it sent words to meanwhile were requeued for later by the sync
         try:
-            word_list = load_words([list_name])
-            word = random.sample(word_list, 1)[0]
-            
-            await bot.send_message(
-                user_id,
-                f"🎯 Your word from '{list_name}' ({current_time.strftime('%H:%M:%S')}):\n\n"
-                f"✨ *{word}*",
-                parse_mode="Markdown"
-            )
-            success = True
+            subscribers.sync()
         except Exception as e:
-            logging.error(f"Failed to send word from list '{list_name}' to {user_id}: {e}")
-   
-    if success:
-        active_users[user_id] = current_time
-        print(f"{active_users[user_id]}")
-        save_users(active_users, user_lists)
-        
-    return success
+            # Delivering on stale state could undo a /stop; retried around the next shard sync
+            logging.error(f"Sync before delivering to {len(user_ids)} users failed: {e}")
+            retry_at = time.time() + LEASE_TTL / 3
+            for user_id in user_ids:
+                delivery_scheduler.schedule(user_id, retry_at)
+            return
+        now = time.time()
+        user_ids = [user_id for user_id in user_ids if next_due_time(user_id) <= now]
+    user_ids = [user_id for user_id in user_ids if subscribers.is_active(user_id)]
+
+    async def deliver(user_id):
+        # Rounds take minutes; the user may have sent /stop since it started
+        if not subscribers.is_active(user_id):
+            return INACTIVE
+        # A long round can outlive this process's lease on the user's shard
+        if not delivers_to(user_id):
+            return DEFERRED
+        return await send_word_to_user(user_id)
+
+    results = await broadcaster.run(user_ids, deliver)
+    for user_id, result in results.items():
+        USERS_SERVED.inc(result=result)
+        if result in PERMANENT_RESULTS:
+            logging.info(f"Unsubscribing {user_id}: {result}")
+            if subscribers.unsubscribe(user_id):
+                stats.record(UNSUBSCRIBED, user_id)
+        elif result == DEFERRED:
+            # Retried after the next lease renewal, or cancelled then if the shard moved
+            delivery_scheduler.schedule(user_id, time.time() + LEASE_TTL / 3)
+        elif result not in (SENT, INACTIVE):
+            delivery_scheduler.schedule(user_id, time.time() + RETRY_DELAY.total_seconds())
+    subscribers.flush_pending()
+    stats.flush()
+
+
+broadcaster = Broadcaster(
+    bot,
+    concurrency=int(os.getenv('BROADCAST_CONCURRENCY', '25')),
+    global_rate=float(os.getenv('BROADCAST_RATE', '30')),  # Telegram allows ~30 messages/s per bot
+    chat_interval=float(os.getenv('BROADCAST_CHAT_INTERVAL', '1.0')),  # and ~1 message/s per chat
+)
+delivery_scheduler = DeliveryScheduler(send_daily_word, RETRY_DELAY.total_seconds())
+subscribers.listeners.append(reschedule_user)
+
+
+async def sync_shards():
+    """Renew shard leases and pick up the other processes' writes to the shared store"""
+    held = set()
+    while True:
+        try:
+            if shard_leases is not None:
+                now_held = shard_leases.renew()
+                if now_held != held:
+                    logging.info(f"Holding shards {sorted(now_held)} of {SHARDS}")
+                    changed, held = now_held ^ held, now_held
+                    for user_id in subscribers.active_user_ids():
+                        if shard_of(user_id, SHARDS) in changed:
+                            reschedule_user(user_id)
+            subscribers.sync()
+        except Exception as e:
+            logging.error(f"Shard sync failed: {e}")
+        await asyncio.sleep(LEASE_TTL / 3)
 
-async def send_daily_word():
-    """Send a random word to all users who haven't received one in 24 hours"""
-    active_users, user_lists = load_active_users_and_lists()
-    if not active_users:
-        return 
-    
-    for user_id in list(active_users.keys()):
-        if await should_send_word(user_id):
-            success = await send_word_to_user(user_id)
-            if not success:
-                del active_users[user_id]
-                save_users(active_users, user_lists)
+
+async def flush_buffers():
+    """Write buffered subscriber changes and stats events once they are WRITE_BEHIND_DELAY old"""
+    while True:
+        subscribers.flush_due()
+        stats.flush_due()
+        await asyncio.sleep(max(WRITE_BEHIND_DELAY / 4, 0.05))
+
+
+async def time_handler(handler, event, data):
+    """Middleware recording each handler's latency"""
+    handler_object = data.get('handler')
+    name = handler_object.callback.__name__ if handler_object is not None else 'unhandled'
+    with HANDLER_SECONDS.time(handler=name):
+        return await handler(event, data)
+
+
+first_update_seen = False
+
+async def first_update_timer(handler, event, data):
+    """Outer middleware recording how long after start the first update was handled"""
+    global first_update_seen
+    try:
+        return await handler(event, data)
+    finally:
+        if not first_update_seen:
+            first_update_seen = True
+            logging.info(f"First update handled {mark_startup('first_update'):.2f}s after start")
+
+
+throttling = ThrottlingMiddleware(UserThrottle(THROTTLE_RATE, THROTTLE_BURST, cooldowns={'skip': SKIP_COOLDOWN}))
+dp.update.outer_middleware(first_update_timer)
+dp.message.outer_middleware(throttling)
+dp.callback_query.outer_middleware(throttling)
+dp.message.middleware(time_handler)
+dp.callback_query.middleware(time_handler)
+dp.inline_query.middleware(time_handler)
 
 @dp.message(Command('skip'))
 async def skip_word(message: types.Message):
     """Skip current word and get a new one"""
-    active_users, user_lists = load_active_users_and_lists()
     user_id = message.from_user.id
-    if user_id not in active_users and user_id not in user_lists:
+    if not subscribers.is_known(user_id):
         await message.reply("You're not subscribed! Use /start first.")
         return
     
+    if not subscribers.is_active(user_id):
+        subscribers.subscribe(user_id)
+        stats.record(SUBSCRIBED, user_id)
+
+        # As in /start: these words are the first delivery, not the queued one
+        delivery_scheduler.cancel(user_id)
+        result = await send_word_to_user(user_id, force=True)
+        if result != SENT and subscribers.is_active(user_id) and delivers_to(user_id):
+            delivery_scheduler.schedule(user_id, time.time() + RETRY_DELAY.total_seconds())
+        return
     await send_word_to_user(user_id, force=True)
 
 @dp.message(Command('start'))
 async def send_welcome(message: types.Message):
     user_id = message.from_user.id
-    active_users, user_lists = load_active_users_and_lists()
-    
-    print(f"Start command received. Current user_lists: {user_lists}")  # Debug print
-    print(f"User {user_id} exists in lists: {user_id in user_lists}")  # Debug print
     
-    available_lists = get_available_wordlists()
-    available_lists_text = "\n".join(f"• {lst}" for lst in sorted(available_lists))
+    logging.debug("start user=%s subscribed=%s", user_id, subscribers.is_active(user_id))
     
-    await message.reply(
-        "Hello! I'm your Daily Word Bot. 📚\n"
-        "You'll receive words from your selected lists every 24 hours.\n"
-        "Available commands:\n"
-        "/stop - Unsubscribe from daily words\n"
-        "/skip - Get new words immediately\n"
-        "/lists - Show your active lists\n"
-        "/addlist <name> - Add a list\n"
-        "/remlist <name> - Remove a list\n"
-        "/list - Show words in current list\n\n"
-        "Available lists\n"
-        f"{available_lists_text}\n"
-        "Use /addlist <list_name> to add a list.\n"
-        "Use /remlist <list_name> to remove a list."
-    )
+    await message.reply(welcome_text())
 
-    # Only initialize if user doesn't exist in either dictionary
-    if user_id not in user_lists:
-        print(f"New user {user_id}, initializing with default list")  # Debug print
-        user_lists[user_id] = DEFAULT_WORDLIST
-        active_users[user_id] = None
-        save_users(active_users, user_lists)
+    # Initialize new users and resubscribe users who used /stop
+    if not subscribers.is_active(user_id):
+        logging.info(f"Subscribing user {user_id}")
+        subscribers.subscribe(user_id)
+        stats.record(SUBSCRIBED, user_id)
 
-        await send_word_to_user(user_id)
+        # subscribe() queued the user as due now; the words below are their first
+        # delivery, mark_sent() then queues the next one
+        delivery_scheduler.cancel(user_id)
+        result = await send_word_to_user(user_id)
+        if result != SENT and subscribers.is_active(user_id) and delivers_to(user_id):
+            delivery_scheduler.schedule(user_id, time.time() + RETRY_DELAY.total_seconds())
 
     else:
-        print(f"Debug - active_users[user_id]: {active_users[user_id]}")
-        time_diff = SEND_INTERVAL - (datetime.now(moscow_tz) - active_users[user_id].astimezone(moscow_tz))
-        hours, remainder = divmod(time_diff.seconds, 3600)
+        wait = max(0, int(next_due_time(user_id) - time.time()))
+        hours, remainder = divmod(wait, 3600)
         minutes, seconds = divmod(remainder, 60)
-        if hours == 0 and minutes == 0 and seconds == 0:
+        if wait == 0:
             await message.reply(
-                "⏳ Please wait about 5 minutes for your next words.\n"
+                "⏳ Your next words are on their way.\n"
                 "Or use /skip to get new words immediately!"
             )
         else:
@@ -261,80 +473,144 @@ async def send_welcome(message: types.Message):
             )
 
 
+@dp.message(Command('time'))
+async def set_delivery_time(message: types.Message, command: CommandObject):
+    """Set the local time of day at which the user gets their words"""
+    user_id = message.from_user.id
+    if not subscribers.is_known(user_id):
+        await message.reply("You're not subscribed! Use /start first.")
+        return
+
+    args = (command.args or "").split()
+    if not args:
+        schedule = parse_schedule(subscribers.schedule_for(user_id))
+        current = (f"every day at {format_schedule(*schedule)}" if schedule
+                   else f"every {SEND_INTERVAL.total_seconds() / 3600:g} hours")
+        await message.reply(
+            f"🕘 You get your words {current}.\n"
+            "Usage: /time HH:MM [timezone], e.g. /time 09:30 Europe/Berlin\n"
+            "/time off - go back to the default interval"
+        )
+        return
+
+    if args[0].lower() == 'off':
+        subscribers.set_schedule(user_id, None)
+        await message.reply(f"🕘 Back to words every {SEND_INTERVAL.total_seconds() / 3600:g} hours.")
+        return
+
+    minute_of_day = parse_time_of_day(args[0])
+    if minute_of_day is None or len(args) > 2:
+        await message.reply("Please give a time as HH:MM.\nUsage: /time HH:MM [timezone]")
+        return
+    tz = find_timezone(args[1]) if len(args) > 1 else user_timezone(user_id)
+    if tz is None:
+        await message.reply(f"Unknown timezone '{args[1]}'. Use a name like Europe/Moscow or America/New_York.")
+        return
+
+    subscribers.set_schedule(user_id, format_schedule(minute_of_day, tz))
+    next_time = datetime.fromtimestamp(next_due_time(user_id), tz)
+    await message.reply(
+        f"🕘 You'll get your words every day at {format_schedule(minute_of_day, tz)}.\n"
+        f"Next delivery: {next_time:%Y-%m-%d %H:%M %Z}"
+    )
+
+
+def user_stats_text(user_id):
+    """/stats reply: words received per list and how often the user skipped"""
+    report = stats.user_report(user_id)
+    per_list = {
+        list_name: kinds.get(DELIVERED, 0) + kinds.get(SKIPPED, 0)
+        for list_name, kinds in report.items() if list_name
+    }
+    received = sum(per_list.values())
+    if not received:
+        return "📊 No words delivered yet."
+    skipped = sum(kinds.get(SKIPPED, 0) for kinds in report.values())
+    lines = [f"📊 You've received {received} words:"]
+    lines.extend(f"• {list_name}: {count}" for list_name, count in sorted(per_list.items(), key=lambda item: -item[1]))
+    lines.append(f"\n⏭ Skipped: {skipped} ({skipped / received:.0%} of your words)")
+    return "\n".join(lines)
+
+
+def admin_stats_text():
+    """/stats all reply: deliveries and active users per day, per list totals and the most delivered words"""
+    lines = [f"📈 Last {STATS_REPORT_DAYS} days (UTC)", "day: words / skips / active users"]
+    totals = {}
+    for day, counts, active in stats.daily_report(STATS_REPORT_DAYS):
+        lines.append(f"{date.fromordinal(day):%m-%d}: {counts[DELIVERED]} / {counts[SKIPPED]} / {active}")
+        for kind, count in counts.items():
+            totals[kind] = totals.get(kind, 0) + count
+    words = totals.get(DELIVERED, 0) + totals.get(SKIPPED, 0)
+    skip_rate = f"{totals.get(SKIPPED, 0) / words:.0%}" if words else "n/a"
+    lines.append(
+        f"\nSubscribed: {totals.get(SUBSCRIBED, 0)}, unsubscribed: {totals.get(UNSUBSCRIBED, 0)}, "
+        f"skip rate: {skip_rate}"
+    )
+
+    per_list = stats.list_report(STATS_REPORT_DAYS)
+    if per_list:
+        lines.append("\n📚 Per list:")
+        lines.extend(
+            f"• {list_name}: {counts[DELIVERED]} words, {counts[SKIPPED]} skips"
+            for list_name, counts in sorted(per_list.items())
+        )
+    top_words = stats.top_words(STATS_TOP_WORDS)
+    if top_words:
+        lines.append("\n🏆 Most delivered words:")
+        lines.extend(
+            f"{number}. {word} ({list_name}): {count}"
+            for number, (list_name, word, count) in enumerate(top_words, 1)
+        )
+    return "\n".join(lines)
+
+
+@dp.message(Command('stats'))
+async def show_stats(message: types.Message, command: CommandObject):
+    """Show the user's statistics, or the aggregate report to admins with /stats all"""
+    user_id = message.from_user.id
+    if command.args and command.args.strip().lower() == 'all' and user_id in ADMIN_IDS:
+        await message.reply(admin_stats_text())
+    else:
+        await message.reply(user_stats_text(user_id))
+
+
 @dp.message(Command('stop'))
 async def stop_notifications(message: types.Message):
     user_id = message.from_user.id
-    active_users, user_lists = load_active_users_and_lists()
-    if user_id in active_users:
-        del active_users[user_id]
-        save_users(active_users, user_lists)
+    if subscribers.is_active(user_id):
+        subscribers.unsubscribe(user_id)
+        stats.record(UNSUBSCRIBED, user_id)
     await message.reply("You've been unsubscribed from daily words. Use /start to subscribe again.")
 
 
 @dp.message(Command('lists'))
 async def show_my_lists(message: types.Message):
     """Show user's active word lists"""
-    active_users, user_lists = load_active_users_and_lists()
     user_id = message.from_user.id
-    if user_id not in active_users and user_id not in user_lists:
+    if not subscribers.is_known(user_id):
         await message.reply("You're not subscribed! Use /start first.")
         return
 
-    selected_lists = user_lists.get(user_id, DEFAULT_WORDLIST)
-    available_lists = get_available_wordlists()
-    
-    active_text = "\n".join(f"• {lst}" for lst in sorted(selected_lists))
-    available_text = "\n".join(f"• {lst}" for lst in sorted(available_lists) if lst not in selected_lists)
-    
-    response = f"📚 Your active lists:\n{active_text}\n"
-    if available_text:
-        response += f"\nAvailable lists:\n{available_text}"
-    
-    await message.reply(
-        f"{response}\n\n"
-        "Commands:\n"
-        "/addlist <name> - Add a list\n"
-        "/remlist <name> - Remove a list"
-    )
+    await message.reply(my_lists_text(tuple(subscribers.lists_for(user_id))))
 
 @dp.message(Command('addlist'))
 async def add_list(message: types.Message, command: CommandObject):
     """Add a word list to user's active lists"""
-    active_users, user_lists = load_active_users_and_lists()
     user_id = message.from_user.id
-    available_lists = get_available_wordlists()
     
     # If no list name provided, show available lists
     if not command.args:
-        user_active_lists = user_lists.get(user_id, DEFAULT_WORDLIST)
-        available_text = "\n".join(
-            f"• {lst}" + (" (active)" if lst in user_active_lists else "")
-            for lst in sorted(available_lists)
-        )
-        await message.reply(
-            "Please provide a list name.\n"
-            f"Available lists:\n{available_text}\n\n"
-            "Usage: /addlist <name>"
-        )
+        await message.reply(add_list_help_text(tuple(subscribers.lists_for(user_id))))
         return
     
     list_name = command.args.strip().lower()
-    print(f"Adding list: {list_name}")  # Debug print
-    print(f"Available lists: {available_lists}")  # Debug print
-    
-    # Rest of the function remains the same...
-    if list_name not in available_lists:
-        await message.reply(f"List '{list_name}' not found! Available lists: {', '.join(available_lists)}")
+    logging.debug("addlist user=%s list=%s", user_id, list_name)
+
+    if list_name not in wordlists:
+        await message.reply(f"List '{list_name}' not found! Available lists: {available_lists_inline()}")
         return
     
-    if user_id not in user_lists:
-        user_lists[user_id] = DEFAULT_WORDLIST
-    
-    if list_name not in user_lists[user_id]:
-        user_lists[user_id].append(list_name)
-        save_success = save_users(active_users, user_lists)
-        print(f"Save success: {save_success}")  # Debug print
-        print(f"User lists after adding: {user_lists}")  # Debug print
+    if subscribers.add_list(user_id, list_name):
         await message.reply(f"Added '{list_name}' to your active lists!")
     else:
         await message.reply(f"List '{list_name}' is already in your active lists!")
@@ -342,9 +618,8 @@ async def add_list(message: types.Message, command: CommandObject):
 @dp.message(Command('remlist'))
 async def remove_list(message: types.Message, command: CommandObject):
     """Remove a word list from user's active lists"""
-    active_users, user_lists = load_active_users_and_lists()
     user_id = message.from_user.id
-    if user_id not in active_users and user_id not in user_lists:
+    if not subscribers.is_known(user_id):
         await message.reply("You're not subscribed! Use /start first.")
         return
     
@@ -354,107 +629,313 @@ async def remove_list(message: types.Message, command: CommandObject):
     
     list_name = command.args.strip().lower()
     
-    if user_id not in user_lists or list_name not in user_lists[user_id]:
+    selected_lists = subscribers.lists_for(user_id)
+    if list_name not in selected_lists:
         await message.reply(f"List '{list_name}' is not in your active lists!")
         return
     
-    if len(user_lists[user_id]) == 1:
+    if len(selected_lists) == 1:
         await message.reply("Cannot remove your last active list!")
         return
     
-    user_lists[user_id].remove(list_name)
-    save_users(active_users, user_lists)
+    subscribers.remove_list(user_id, list_name)
     await message.reply(f"Removed '{list_name}' from your active lists!")
 
+def render_list_page(word_list, page, language=None):
+    """Render one page of a sorted word list, optionally of one language, and its navigation keyboard"""
+    pages = word_list.page_count(LIST_PAGE_SIZE, language)
+    page = min(max(page, 0), pages - 1)
+    words_text = "\n".join(
+        f"• {word if len(word) <= LIST_ENTRY_LIMIT else word[:LIST_ENTRY_LIMIT] + '…'}"
+        for word in word_list.page(page, LIST_PAGE_SIZE, language)
+    )
+    if language is None:
+        title = f"📚 Words in '{word_list.name}'"
+        suffix = ""
+    else:
+        # Callback data is limited to 64 bytes, so the language goes by its position
+        language_keys = list(word_list.languages())
+        title = f"📚 {word_list.languages()[language][0]} words in '{word_list.name}'"
+        suffix = f":{language_keys.index(language)}"
+    text = f"{title} (page {page + 1}/{pages}):\n\n{words_text}"
+
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(text="◀️ Prev", callback_data=f"list:{word_list.name}:{page - 1}{suffix}"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton(text="Next ▶️", callback_data=f"list:{word_list.name}:{page + 1}{suffix}"))
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+    return text, keyboard
+
 @dp.message(Command('list'))
 async def show_list_words(message: types.Message, command: CommandObject):
-    """Show words in a specified list or user's active lists"""
-    active_users, user_lists = load_active_users_and_lists()
+    """Show a page of words from a specified list or from user's active lists"""
     user_id = message.from_user.id
     
-    # If list name provided, show that specific list
+    # If list name provided, show that specific list, optionally of one language and from a given page
     if command.args:
-        list_name = command.args.strip().lower()
-        available_lists = get_available_wordlists()
+        list_name, *rest = command.args.strip().lower().split()
+        page = int(rest.pop()) - 1 if rest and rest[-1].isdigit() else 0
+        word_list = wordlists.get(list_name)
         
-        if list_name not in available_lists:
-            lists = ", ".join(available_lists)
+        if word_list is None:
+            lists = available_lists_inline()
             await message.reply(
                 f"Word list '{list_name}' not found!\n"
                 f"Available lists: {lists}"
             )
             return
+
+        language = None
+        if rest:
+            language = language_key(" ".join(rest))
+            if language not in word_list.languages():
+                await message.reply(
+                    f"No '{' '.join(rest)}' words in '{list_name}'.\n"
+                    f"Use /languages {list_name} to see which languages it has."
+                )
+                return
+
+        text, keyboard = render_list_page(word_list, page, language)
+        await message.reply(text, reply_markup=keyboard)
             
-        try:
-            words = load_words([list_name])
-            words_text = "\n".join(f"• {word}" for word in sorted(words))
-            
-            # Split message if it's too long
-            if len(words_text) > 4000:
-                await message.reply(f"📚 Words in '{list_name}' (showing first 100):\n\n" + 
-                                  "\n".join(f"• {word}" for word in sorted(words)[:100]) +
-                                  "\n\n(List truncated due to length)")
-            else:
-                await message.reply(f"📚 Words in '{list_name}':\n\n{words_text}")
-                
-        except Exception as e:
-            logging.error(f"Error showing word list: {e}")
-            await message.reply("Error loading word list!")
-            
-    # If no list specified, show words from user's active lists
+    # If no list specified, show the first page of each of user's active lists
     else:
-        if user_id not in user_lists:
+        if not subscribers.is_known(user_id):
             await message.reply("You're not subscribed! Use /start first.")
             return
             
-        selected_lists = user_lists.get(user_id, DEFAULT_WORDLIST)
-        for list_name in selected_lists:
-            try:
-                words = load_words([list_name])
-                words_text = "\n".join(f"• {word}" for word in sorted(words[:20]))
-                await message.reply(
-                    f"📚 Sample words from '{list_name}' (first 20):\n\n{words_text}\n\n"
-                    f"Use /list {list_name} to see full list"
-                )
-            except Exception as e:
-                logging.error(f"Error showing word list '{list_name}': {e}")
+        for list_name in subscribers.lists_for(user_id):
+            word_list = wordlists.get(list_name)
+            if word_list is None:
+                logging.error(f"Error showing word list '{list_name}': not found")
+                continue
+            text, keyboard = render_list_page(word_list, 0)
+            await message.reply(text, reply_markup=keyboard)
+
+@dp.callback_query(F.data.startswith('list:'))
+async def turn_list_page(callback: types.CallbackQuery):
+    """Show another page of a word list when a navigation button is pressed"""
+    list_name, page, *language_id = callback.data[len('list:'):].split(':')
+    word_list = wordlists.get(list_name)
+    if word_list is None or not page.isdigit():
+        await callback.answer(f"Word list '{list_name}' is no longer available")
+        return
+
+    language = None
+    if language_id:
+        language_keys = list(word_list.languages())
+        if not language_id[0].isdigit() or int(language_id[0]) >= len(language_keys):
+            await callback.answer(f"Word list '{list_name}' has changed, use /list again")
+            return
+        language = language_keys[int(language_id[0])]
+
+    text, keyboard = render_list_page(word_list, int(page), language)
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except TelegramBadRequest as e:
+        # Pressing a button twice would re-render the same page
+        if 'message is not modified' not in str(e):
+            raise
+    await callback.answer()
+
+@dp.message(Command('languages'))
+async def show_languages(message: types.Message, command: CommandObject):
+    """Show the languages of a word list with their entry counts"""
+    if not command.args:
+        await message.reply("Please provide a list name.\nUsage: /languages <name>")
+        return
+
+    list_name = command.args.strip().lower()
+    word_list = wordlists.get(list_name)
+    if word_list is None:
+        await message.reply(f"Word list '{list_name}' not found! Available lists: {available_lists_inline()}")
+        return
+
+    languages = word_list.languages()
+    if not languages:
+        await message.reply(f"Entries in '{list_name}' have no language.")
+        return
+    lines = [f"• {display} ({len(ids)})" for display, ids in languages.values()]
+    sections = [f"🌍 Languages in '{list_name}' (use /list {list_name} <language>):"] + lines
+    for text in split_message(sections, separator="\n"):
+        await message.reply(text)
+
+def find_words(query, list_names, limit=FIND_LIMIT):
+    """Search the given lists, returns (list_name, index, entry) tuples"""
+    matches = []
+    for list_name in list_names:
+        word_list = wordlists.get(list_name)
+        if word_list is None:
+            continue
+        for index in word_list.index.search(query, limit - len(matches)):
+            matches.append((list_name, index, word_list[index]))
+        if len(matches) >= limit:
+            break
+    return matches
+
+@dp.message(Command('find'))
+async def find_word(message: types.Message, command: CommandObject):
+    """Find words by prefix or substring in user's lists, or in all lists with 'all'"""
+    user_id = message.from_user.id
+    query = (command.args or "").strip()
+    if query.lower().startswith('all '):
+        list_names = get_available_wordlists()
+        query = query[4:].strip()
+    elif subscribers.is_known(user_id):
+        list_names = subscribers.lists_for(user_id)
+    else:
+        list_names = get_available_wordlists()
+
+    if not query:
+        await message.reply("Please provide a search query.\nUsage: /find [all] <query>")
+        return
+
+    matches = find_words(query, list_names)
+    if not matches:
+        await message.reply(f"Nothing found for '{query}'.")
+        return
+
+    results_text = "\n".join(
+        f"• {entry if len(entry) <= LIST_ENTRY_LIMIT else entry[:LIST_ENTRY_LIMIT] + '…'} ({list_name})"
+        for list_name, _, entry in matches
+    )
+    await message.reply(f"🔍 Results for '{query}':\n\n{results_text}")
+
+@dp.inline_query()
+async def inline_find_word(inline_query: types.InlineQuery):
+    """Search all lists from any chat via @bot <query>"""
+    query = inline_query.query.strip()
+    results = []
+    if query:
+        results = [
+            InlineQueryResultArticle(
+                id=f"{list_name}:{index}",
+                title=entry[:100],
+                description=list_name,
+                input_message_content=InputTextMessageContent(message_text=entry),
+            )
+            for list_name, index, entry in find_words(query, get_available_wordlists())
+        ]
+    await inline_query.answer(results, cache_time=60)
 
 @dp.message()
 async def handle_any_message(message: types.Message):
     """Handle any unrecognized message or command"""
-    active_users, user_lists = load_active_users_and_lists()
     user_id = message.from_user.id
-    if user_id not in active_users and user_id not in user_lists:
+    if not subscribers.is_known(user_id):
         await message.reply("You're not subscribed! Use /start first.")
         return
     
-    available_lists = get_available_wordlists()
-    available_lists_text = "\n".join(f"• {lst}" for lst in sorted(available_lists))
+    await message.reply(help_text())
+
+def check():
+    """Validate the configuration, user store and word lists without connecting to Telegram.
+
+    Run as `python bot.py --check`; exits non-zero if anything is wrong. A
+    missing or malformed BOT_TOKEN already stops the import above.
+    """
+    problems = []
+    for name, value, allowed in (
+        ('BOT_ROLE', BOT_ROLE, ('all', 'updates', 'delivery')),
+        ('BOT_MODE', BOT_MODE, ('polling', 'webhook')),
+        ('DELIVERY_MODE', DELIVERY_MODE, ('per_list', 'batched')),
+    ):
+        if value not in allowed:
+            problems.append(f"{name} is '{value}', expected one of {', '.join(allowed)}")
+    if BOT_MODE == 'webhook' and BOT_ROLE != 'delivery' and not WEBHOOK_SECRET:
+        problems.append("BOT_MODE=webhook needs WEBHOOK_SECRET")
+
+    try:
+        logging.info(f"User store {check_user_store(USER_STORE, legacy_json='users.json')}")
+    except Exception as e:
+        problems.append(f"Cannot read user store {USER_STORE}: {e}")
+
+    # Read-only like check_user_store: stale packs are reported, not recompiled
+    names = wordlists.names()
+    for name in names:
+        try:
+            entries, fresh = wordlists.inspect(name)
+        except Exception as e:
+            problems.append(f"Word list '{name}' is unreadable: {e}")
+            continue
+        if not entries:
+            problems.append(f"Word list '{name}' is empty")
+        else:
+            logging.info(f"Word list '{name}': {entries} entries" + ("" if fresh else ", pack compiled on first use"))
+    missing = [name for name in DEFAULT_WORDLIST if name not in names]
+    if missing:
+        problems.append(f"Default word lists missing from {WORDLISTS_DIR}/: {', '.join(missing)}")
+
+    for problem in problems:
+        logging.error(problem)
+    logging.info(f"Checked {len(names)} word lists: {len(problems)} problems")
+    return 1 if problems else 0
 
-    await message.reply(
-        "Available commands:\n"
-        "/stop - Unsubscribe from daily words\n"
-        "/skip - Get new words immediately\n"
-        "/lists - Show your active lists\n"
-        "/addlist <name> - Add a list\n"
-        "/remlist <name> - Remove a list\n"
-        "/list - Show words in current list\n\n"
-        "Available lists\n"
-        f"{available_lists_text}\n"
-        "Use /addlist <list_name> to add a list.\n"
-        "Use /remlist <list_name> to remove a list."
-    )
 
 async def main():
-    # Initialize scheduler
-    scheduler = AsyncIOScheduler()
-    scheduler.add_job(send_daily_word, 'interval', seconds=300)
-    scheduler.start()
+    global shard_leases
+    logging.info(f"Imported {mark_startup('imported'):.2f}s after start")
+    if SHARDS and BOT_ROLE != 'updates':
+        _, store_path = parse_store_spec(USER_STORE, legacy_json='users.json')
+        shard_leases = ShardLeases(store_path, SHARDS, f"{socket.gethostname()}:{os.getpid()}", LEASE_TTL)
+    metrics_runner = await serve_metrics(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    loading = asyncio.create_task(load_subscribers())
+    tasks = [loading]
+
+    # Stop through the finally block below so buffered writes reach the store;
+    # polling replaces these with its own handlers, which stop it the same way
+    main_task = asyncio.current_task()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signum, main_task.cancel)
+        except NotImplementedError:  # Windows
+            pass
     
-    # Delete webhook before polling
-    await bot.delete_webhook(drop_pending_updates=True)
-    # Start polling
-    await dp.start_polling(bot)
+    try:
+        polling = BOT_ROLE != 'delivery' and BOT_MODE != 'webhook'
+        if polling:
+            # Delete webhook before polling, while the subscribers load
+            await bot.delete_webhook(drop_pending_updates=True)
+        await loading
+        tasks.append(asyncio.create_task(flush_buffers()))
+        if BOT_ROLE != 'updates':
+            tasks.append(asyncio.create_task(delivery_scheduler.run()))
+        if SHARDS:
+            tasks.append(asyncio.create_task(sync_shards()))
+        logging.info(f"Ready {mark_startup('ready'):.2f}s after start")
+
+        if BOT_ROLE == 'delivery':
+            # Telegram delivers updates to a single poller or webhook, run in the 'updates' process
+            await asyncio.gather(*tasks)
+        elif not polling:
+            from webhook import run_webhook  # pulls in aiohttp.web, only needed here
+            await run_webhook(
+                dp, bot, WEBHOOK_SECRET,
+                path=WEBHOOK_PATH,
+                host=WEBHOOK_HOST,
+                port=WEBHOOK_PORT,
+                public_url=WEBHOOK_URL,
+                workers=WEBHOOK_WORKERS,
+            )
+        else:
+            await dp.start_polling(bot)
+    finally:
+        for task in tasks:
+            task.cancel()
+        subscribers.flush_pending()
+        stats.flush()
+        stats.close()
+        if shard_leases is not None:
+            shard_leases.release()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await bot.session.close()
 
 if __name__ == '__main__':
-    asyncio.run(main()) 
\ No newline at end of file
+    if '--check' in sys.argv[1:]:
+        sys.exit(check())
+    try:
+        asyncio.run(main())
+    except asyncio.CancelledError:
+        logging.info("Stopped by signal")
\ No newline at end of file
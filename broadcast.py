@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from metrics import SEND_SECONDS, TELEGRAM_ERRORS, telegram_error_code
+
+# Delivery results
+SENT = 'sent'
+BLOCKED = 'blocked'  # user blocked the bot or deleted their account
+CHAT_NOT_FOUND = 'chat_not_found'
+TRANSIENT = 'transient'  # network / server trouble, worth retrying later
+FAILED = 'failed'  # Telegram rejected the message itself
+DEFERRED = 'deferred'  # not attempted by this process, e.g. its shard lease ran out
+INACTIVE = 'inactive'  # not attempted, the user unsubscribed while waiting for their turn
+
+PERMANENT_RESULTS = (BLOCKED, CHAT_NOT_FOUND)
+
+MESSAGE_LIMIT = 4096  # Telegram's maximum message length
+
+
+def split_message(parts, separator="\n\n", limit=MESSAGE_LIMIT):
+    """Join text parts into as few messages as possible under `limit` characters.
+
+    Parts are never split unless a single part is longer than the limit.
+    """
+    messages = []
+    current = ""
+    for part in parts:
+        while len(part) > limit:
+            if current:
+                messages.append(current)
+                current = ""
+            messages.append(part[:limit])
+            part = part[limit:]
+        if not current:
+            current = part
+        elif len(current) + len(separator) + len(part) <= limit:
+            current += separator + part
+        else:
+            messages.append(current)
+            current = part
+    if current:
+        messages.append(current)
+    return messages
+
+
+def classify_error(error):
+    """Map a Telegram API exception to a delivery result"""
+    if isinstance(error, TelegramForbiddenError):
+        return BLOCKED
+    if isinstance(error, TelegramBadRequest):
+        if 'chat not found' in str(error).lower():
+            return CHAT_NOT_FOUND
+        return FAILED
+    if isinstance(error, (TelegramNetworkError, TelegramServerError, TelegramRetryAfter, asyncio.TimeoutError)):
+        return TRANSIENT
+    return FAILED
+
+
+class TokenBucket:
+    """Async token bucket; callers reserve a token and sleep until it is available"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def pause(self, seconds):
+        """Stop handing out tokens for `seconds` (used on 429 responses)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        delay = max(-self.tokens / self.rate, self.paused_until - now)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class ChatRateLimiter:
+    """Spaces out messages to the same chat by at least `interval` seconds"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next_slot = {}
+
+    async def acquire(self, chat_id):
+        now = time.monotonic()
+        slot = max(now, self._next_slot.get(chat_id, 0.0))
+        self._next_slot[chat_id] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def prune(self):
+        now = time.monotonic()
+        self._next_slot = {chat_id: slot for chat_id, slot in self._next_slot.items() if slot > now}
+
+
+class Broadcaster:
+    """Sends messages under Telegram's global and per-chat rate limits.
+
+    `send_messages` retries 429 responses after their `retry_after` and
+    transient network errors with exponential back-off; `run` calls a
+    per-user delivery coroutine for many users with bounded concurrency.
+    """
+
+    def __init__(self, bot, concurrency=25, global_rate=30, chat_interval=1.0, max_retries=3):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_limiter = ChatRateLimiter(chat_interval)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        """Send one message, returns a delivery result"""
+        started = time.perf_counter()
+        result = await self._send_message(chat_id, text, **kwargs)
+        SEND_SECONDS.observe(time.perf_counter() - started, result=result)
+        return result
+
+    async def _send_message(self, chat_id, text, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            await self.chat_limiter.acquire(chat_id)
+            await self.global_bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id, text, **kwargs)
+                return SENT
+            except TelegramRetryAfter as e:
+                TELEGRAM_ERRORS.inc(code=telegram_error_code(e))
+                logging.warning(f"Flood control for {chat_id}, retrying in {e.retry_after}s")
+                self.global_bucket.pause(e.retry_after)
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                TELEGRAM_ERRORS.inc(code=telegram_error_code(e))
+                result = classify_error(e)
+                if result != TRANSIENT or attempt == self.max_retries:
+                    logging.error(f"Failed to send message to {chat_id} ({result}): {e}")
+                    return result
+                await asyncio.sleep(2 ** attempt)
+        return TRANSIENT
+
+    async def send_messages(self, chat_id, texts, **kwargs):
+        """Send several messages to one chat in order.
+
+        Returns SENT if at least one message went through; stops early when
+        the chat turns out to be unreachable.
+        """
+        result = FAILED
+        for text in texts:
+            message_result = await self.send_message(chat_id, text, **kwargs)
+            if message_result == SENT:
+                result = SENT
+            elif message_result in PERMANENT_RESULTS:
+                return message_result
+            elif result != SENT:
+                result = message_result
+        return result
+
+    async def run(self, user_ids, deliver):
+        """Call `deliver(user_id)` for every user, returns {user_id: result}"""
+        results = {}
+        pending = iter(user_ids)
+
+        async def worker():
+            for user_id in pending:
+                try:
+                    results[user_id] = await deliver(user_id)
+                except Exception as e:
+                    logging.error(f"Delivery to {user_id} failed: {e}")
+                    results[user_id] = TRANSIENT
+
+        started = time.monotonic()
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        await asyncio.gather(*workers)
+        self.chat_limiter.prune()
+        if results:
+            summary = ", ".join(f"{result}={count}" for result, count in sorted(Counter(results.values()).items()))
+            logging.info(f"Delivered to {len(results)} users in {time.monotonic() - started:.1f}s: {summary}")
+        return results
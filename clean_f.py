@@ -1,33 +1,163 @@
-import re
-
-def clean_wordlist(input_file, output_file):
-    # Read the input file
-    with open(input_file, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
-    # Remove empty quotes
-    content = content.replace("", "")
-    
-    # Remove standalone page numbers (digits followed by newline)
-    content = re.sub(r'\n\d+\n', '\n', content)
-    
-    # Remove single letters marking sections (single uppercase letter on a line)
-    content = re.sub(r'\n[A-ZА-Я]\n', '\n', content)
-    
-    # Join lines not starting with uppercase letter to previous line
-    content = re.sub(r'\n(?![А-ЯA-Z])', ' ', content)
-    
-    # Remove multiple consecutive newlines
-    content = re.sub(r'\n\s*\n', '\n', content)
-    
-    # Remove leading/trailing whitespace
-    content = content.strip()
-    
-    # Write the cleaned content to output file
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(content)
-
-# Usage
-input_file = 'wordlists/fenia.txt'
-output_file = 'wordlists/fenia_cleaned.txt'
-clean_wordlist(input_file, output_file)
\ No newline at end of file
+"""Clean word lists extracted from dictionary dumps.
+
+Streams the input line by line and writes entries as soon as they are
+complete, so memory use does not depend on file size:
+
+* lines holding only a page number are dropped,
+* lines holding a single uppercase letter (section headers) are dropped,
+* blank lines are dropped,
+* lines not starting with an uppercase letter continue the previous entry.
+
+    python clean_f.py wordlists/fenia.txt                # -> wordlists/fenia_cleaned.txt
+    python clean_f.py wordlists/*.txt --in-place --dedupe
+    python clean_f.py wordlists/fenia.txt --format tsv   # -> wordlists/fenia_cleaned.tsv
+
+With `--format tsv` each entry is split into the structured fields of
+entries.py and written as a `.tsv` list.
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from entries import FIELDS, parse_line
+
+
+class WordlistCleaner:
+    """Line-at-a-time state machine; feed lines, collect finished entries"""
+
+    def __init__(self, dedupe=False, track_duplicates=True):
+        self.dedupe = dedupe
+        self.track_duplicates = track_duplicates or dedupe
+        self.stats = Counter()
+        self._seen = set()
+        self._entry = None
+
+    def _finish(self):
+        entry, self._entry = self._entry, None
+        if entry is None:
+            return None
+        if self.track_duplicates:
+            key = hashlib.blake2b(entry.encode('utf-8'), digest_size=8).digest()
+            if key in self._seen:
+                self.stats['duplicates'] += 1
+                if self.dedupe:
+                    return None
+            else:
+                self._seen.add(key)
+        self.stats['entries'] += 1
+        return entry
+
+    def feed(self, line):
+        """Process one input line, returns a finished entry or None"""
+        self.stats['lines'] += 1
+        line = line.rstrip()
+        stripped = line.lstrip()
+        if not stripped:
+            self.stats['blank_lines'] += 1
+            return None
+        if stripped.isdigit():
+            self.stats['page_numbers'] += 1
+            return None
+        if len(stripped) == 1 and stripped.isupper():
+            self.stats['section_letters'] += 1
+            return None
+
+        if line[0].isupper() or self._entry is None:
+            finished = self._finish()
+            self._entry = stripped
+            return finished
+
+        self.stats['joined_lines'] += 1
+        self._entry = f"{self._entry} {stripped}"
+        return None
+
+    def close(self):
+        """Flush the last entry"""
+        return self._finish()
+
+
+def _tsv_line(entry):
+    return '\t'.join(' '.join(value.split()) for value in parse_line(entry)) + '\n'
+
+
+def clean_wordlist(input_file, output_file, dedupe=False, track_duplicates=True, output_format='txt'):
+    """Clean `input_file` into `output_file`, returns the cleaner's stats"""
+    cleaner = WordlistCleaner(dedupe, track_duplicates)
+    render = _tsv_line if output_format == 'tsv' else lambda entry: entry + '\n'
+    with open(input_file, 'r', encoding='utf-8') as source, \
+            open(output_file, 'w', encoding='utf-8') as target:
+        if output_format == 'tsv':
+            target.write('\t'.join(FIELDS) + '\n')
+        for line in source:
+            entry = cleaner.feed(line)
+            if entry is not None:
+                target.write(render(entry))
+        entry = cleaner.close()
+        if entry is not None:
+            target.write(render(entry))
+    return cleaner.stats
+
+
+def default_output(input_file, output_format='txt'):
+    root, ext = os.path.splitext(input_file)
+    if output_format == 'tsv':
+        ext = '.tsv'
+    return f"{root}_cleaned{ext or '.txt'}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs='+')
+    parser.add_argument('-o', '--output', help="output file (only with a single input)")
+    parser.add_argument('--in-place', action='store_true', help="replace each input with its cleaned version")
+    parser.add_argument('--dedupe', action='store_true', help="drop repeated entries instead of just counting them")
+    parser.add_argument('--no-duplicate-check', action='store_true',
+                        help="skip duplicate detection to keep memory constant on huge inputs")
+    parser.add_argument('--format', choices=('txt', 'tsv'), default='txt',
+                        help="write plain lines or structured records")
+    args = parser.parse_args()
+    if args.output and len(args.inputs) > 1:
+        parser.error("--output needs a single input file")
+    if args.in_place and args.format == 'tsv':
+        parser.error("--in-place keeps the input format, use -o for a .tsv output")
+
+    for input_file in args.inputs:
+        if args.in_place:
+            # Not .txt, or a running bot would load the half-written file as a new list
+            fd, output_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(input_file)), suffix='.tmp')
+            os.close(fd)
+        else:
+            output_file = args.output or default_output(input_file, args.format)
+
+        started = time.perf_counter()
+        try:
+            stats = clean_wordlist(input_file, output_file, args.dedupe, not args.no_duplicate_check, args.format)
+            if args.in_place:
+                shutil.copymode(input_file, output_file)  # mkstemp creates 0600
+                os.replace(output_file, input_file)
+        except BaseException:
+            if args.in_place:
+                os.unlink(output_file)
+            raise
+        elapsed = time.perf_counter() - started
+        if args.in_place:
+            output_file = input_file
+
+        dropped = stats['page_numbers'] + stats['section_letters'] + stats['blank_lines']
+        print(
+            f"{input_file} -> {output_file}: {stats['lines']} lines, {stats['entries']} entries written, "
+            f"{dropped} lines dropped ({stats['page_numbers']} page numbers, "
+            f"{stats['section_letters']} section letters, {stats['blank_lines']} blank), "
+            f"{stats['joined_lines']} continuation lines joined, {stats['duplicates']} duplicates "
+            f"in {elapsed:.2f}s",
+            file=sys.stderr,
+        )
+
+
+if __name__ == '__main__':
+    main()
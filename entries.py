@@ -0,0 +1,82 @@
+"""Structured word list entries.
+
+An entry has the fields in FIELDS; missing fields are empty strings.
+Structured lists are stored as `.tsv` files whose first line names the
+columns. Plain `.txt` lines are split into fields by recognising the two
+formats our lists use:
+
+    <headword> (произносится <pronunciation>) – <definition>. <language>
+    <headword>: <definition>
+"""
+import re
+
+from search import fold
+
+FIELDS = ('headword', 'pronunciation', 'definition', 'language')
+TSV_EXTENSION = '.tsv'
+
+MATNO_PATTERN = re.compile(r'^(?P<headword>.*?) \(произносится (?P<pronunciation>.*?)\) – (?P<definition>.*)$')
+
+
+def make_record(headword='', pronunciation='', definition='', language=''):
+    return (headword, pronunciation, definition, language)
+
+
+def parse_line(line):
+    """Split a plain text entry into a record"""
+    match = MATNO_PATTERN.match(line)
+    if match:
+        definition, _, language = match.group('definition').rpartition('. ')
+        if not definition:
+            definition, language = language, ''
+        return make_record(match.group('headword'), match.group('pronunciation'), definition, language)
+    headword, separator, definition = line.partition(': ')
+    if separator and headword and definition:
+        return make_record(headword, definition=definition)
+    return make_record(line)
+
+
+def format_record(record):
+    """Render a record back into the plain text line format"""
+    headword, pronunciation, definition, language = record
+    if pronunciation or language:
+        return f"{headword} (произносится {pronunciation}) – {definition}. {language}".rstrip()
+    if definition:
+        return f"{headword}: {definition}"
+    return headword
+
+
+def _clean_field(value):
+    return ' '.join((value or '').split())
+
+
+def write_tsv(file, records):
+    """Write records to an open text file, header line first"""
+    file.write('\t'.join(FIELDS) + '\n')
+    for record in records:
+        file.write('\t'.join(_clean_field(value) for value in record) + '\n')
+
+
+def read_tsv(path):
+    """Read records from a `.tsv` list, mapping its header onto FIELDS"""
+    with open(path, 'r', encoding='utf-8') as file:
+        header = file.readline().rstrip('\n').split('\t')
+        positions = [header.index(field) if field in header else None for field in FIELDS]
+        records = []
+        for line in file:
+            values = line.rstrip('\n').split('\t')
+            if not any(values):
+                continue
+            records.append(tuple(
+                values[position] if position is not None and position < len(values) else ''
+                for position in positions
+            ))
+    return records
+
+
+def language_key(language):
+    """Normalised language name used for filtering: case-folded, without the 'мат' suffix"""
+    key = fold(language).strip()
+    if key.endswith(' мат'):
+        key = key[:-len(' мат')]
+    return key
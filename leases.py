@@ -0,0 +1,110 @@
+"""Shard leases for running delivery in several processes.
+
+Subscribers are split into `shards` buckets by a hash of their user id.
+Worker processes sharing one SQLite database take time-limited leases on
+shards and only schedule deliveries for users in shards they hold:
+
+* every worker heartbeats in `lease_workers` and aims for an equal share
+  of the shards among the workers seen within the last `ttl` seconds,
+* free and expired shards are claimed, shards above the fair share are
+  released so that a newly started worker gets its part,
+* a worker that dies stops renewing; its shards expire after `ttl`
+  seconds and are picked up by the others.
+
+Workers renew every `ttl / 3` seconds. A lease is only trusted while it
+has at least `margin` seconds left, so a worker that stalls stops
+delivering before anyone else can claim its shards.
+"""
+import logging
+import math
+import sqlite3
+import time
+
+_MASK64 = (1 << 64) - 1
+
+
+def shard_of(user_id, shards):
+    """Stable shard of a user id (Fibonacci hashing, same result in every process)"""
+    return (((user_id * 0x9E3779B97F4A7C15) & _MASK64) >> 32) % shards
+
+
+class ShardLeases:
+    def __init__(self, path, shards, owner, ttl=30.0, margin=None):
+        self.shards = shards
+        self.owner = owner
+        self.ttl = ttl
+        # Renewing every ttl / 3 keeps held leases at least this far from expiring
+        self.margin = ttl / 3 if margin is None else margin
+        self.held = {}  # shard -> expires_at
+        self.conn = sqlite3.connect(path, isolation_level=None, timeout=ttl / 2)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS shard_leases ("
+            " shard INTEGER PRIMARY KEY,"
+            " owner TEXT NOT NULL,"
+            " expires_at REAL NOT NULL"
+            ")"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS lease_workers (owner TEXT PRIMARY KEY, seen_at REAL NOT NULL)")
+
+    def holds(self, shard):
+        return self.held.get(shard, 0.0) - self.margin > time.time()
+
+    def holds_user(self, user_id):
+        return self.holds(shard_of(user_id, self.shards))
+
+    def renew(self):
+        """Heartbeat, extend held leases and rebalance; returns the set of shards now held"""
+        now = time.time()
+        expires_at = now + self.ttl
+        conn = self.conn
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT OR REPLACE INTO lease_workers (owner, seen_at) VALUES (?, ?)", (self.owner, now))
+            conn.execute("DELETE FROM lease_workers WHERE seen_at < ?", (now - self.ttl,))
+            workers = conn.execute("SELECT COUNT(*) FROM lease_workers").fetchone()[0]
+            fair_share = math.ceil(self.shards / max(workers, 1))
+
+            conn.execute(
+                "UPDATE shard_leases SET expires_at = ? WHERE owner = ? AND expires_at > ?",
+                (expires_at, self.owner, now),
+            )
+            held = [row[0] for row in conn.execute(
+                "SELECT shard FROM shard_leases WHERE owner = ? AND expires_at > ? ORDER BY shard",
+                (self.owner, now),
+            )]
+            if len(held) > fair_share:
+                released = held[fair_share:]
+                conn.executemany("DELETE FROM shard_leases WHERE shard = ? AND owner = ?",
+                                 [(shard, self.owner) for shard in released])
+                held = held[:fair_share]
+            elif len(held) < fair_share:
+                taken = {row[0] for row in conn.execute("SELECT shard FROM shard_leases WHERE expires_at > ?", (now,))}
+                free = [shard for shard in range(self.shards) if shard not in taken]
+                for shard in free[:fair_share - len(held)]:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO shard_leases (shard, owner, expires_at) VALUES (?, ?, ?)",
+                        (shard, self.owner, expires_at),
+                    )
+                    held.append(shard)
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            logging.error(f"Cannot renew shard leases: {e}")
+            return set(shard for shard in self.held if self.holds(shard))
+
+        self.held = {shard: expires_at for shard in held}
+        return set(held)
+
+    def release(self):
+        """Give up all shards, e.g. on shutdown, so other workers take them over at once"""
+        try:
+            self.conn.execute("DELETE FROM shard_leases WHERE owner = ?", (self.owner,))
+            self.conn.execute("DELETE FROM lease_workers WHERE owner = ?", (self.owner,))
+        except sqlite3.Error as e:
+            logging.error(f"Cannot release shard leases: {e}")
+        self.held = {}
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,245 @@
+"""Extraction of word entries from matno.ru board pages.
+
+Three interchangeable parser backends produce the same blocks:
+`selectolax` and `lxml` (optional dependencies, much faster) and the
+original BeautifulSoup `html.parser` implementation, used as the fallback
+and as the reference output.
+"""
+from bs4 import BeautifulSoup
+
+from entries import make_record
+
+try:
+    import lxml.html
+except ImportError:  # optional
+    lxml = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # optional
+    LexborHTMLParser = None
+
+BACKENDS = ('selectolax', 'lxml', 'html.parser')
+
+
+def available_backends():
+    available = []
+    if LexborHTMLParser is not None:
+        available.append('selectolax')
+    if lxml is not None:
+        available.append('lxml')
+    available.append('html.parser')
+    return available
+
+
+def _clean_main_message(main_message):
+    """Strip usage examples and notes, then split the message on '|'"""
+    if not main_message:
+        return main_message, None
+    # Remove "Пример употребления" and "Примечание" sections from the main message
+    main_message = main_message.split("Пример употребления:")[0]
+    main_message = main_message.split("Примечание:")[0].strip()
+    return main_message, [part.strip() for part in main_message.split('|')]
+
+
+def _views_from_text(details_text):
+    views_start = details_text.find("Прочитали:")
+    if views_start == -1:
+        return None
+    return details_text[views_start:].split('|')[0].replace("Прочитали:", "").strip()
+
+
+def _make_block(title, link, message_text, date, author, views, rating, language):
+    main_message, main_message_parts = _clean_main_message(message_text)
+    return {
+        "title": title,
+        "link": link,
+        "main_message": main_message,
+        "main_message_parts": main_message_parts,
+        "date": date,
+        "author": author,
+        "views": views,
+        "rating": rating,
+        "language": language,
+    }
+
+
+def _parse_with_bs4(html):
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Find all blocks with a specific ID pattern or class
+    blocks = soup.find_all('div', id=lambda x: x and x.startswith('entryID'))
+
+    parsed_blocks = []
+
+    for block in blocks:
+        # Extract the title and link from the eTitle div
+        title_div = block.find('div', class_='eTitle')
+        title = title_div.a.text if title_div and title_div.a else None
+        link = title_div.a['href'] if title_div and title_div.a and 'href' in title_div.a.attrs else None
+
+        # Extract the main message
+        message_div = block.find('div', class_='eMessage')
+        main_message = message_div.text.strip() if message_div else None
+
+        # Extract additional details like rating, date, author, views, and language
+        details_div = block.find('div', class_='eDetails')
+
+        # Extract date
+        date_span = details_div.find('span', title=True) if details_div else None
+        date = date_span['title'] if date_span and 'title' in date_span.attrs else None
+
+        # Extract author
+        author = details_div.find('u').text if details_div and details_div.find('u') else None
+
+        # Extract views
+        views = _views_from_text(details_div.text) if details_div else None
+
+        # Extract rating
+        rating_span = details_div.find('span', id=lambda x: x and x.startswith('entRating')) if details_div else None
+        rating = rating_span.text if rating_span else None
+
+        # Extract language
+        language_link = details_div.find('a', href=lambda x: x and 'mat' in x) if details_div else None
+        language = language_link.text if language_link else None
+
+        parsed_blocks.append(_make_block(title, link, main_message, date, author, views, rating, language))
+
+    return parsed_blocks
+
+
+def _extract_entry(block, children_of, tag_of, attrs_of, text_of):
+    """Extract an entry block in a single pass over its descendants.
+
+    Picks the first eTitle/eMessage/eDetails divs, the first link inside the
+    title and the date, author, rating and language elements inside the
+    details, in document order, exactly as the BeautifulSoup backend's
+    `find` calls do. `tag_of` returns None for text and comment nodes.
+    """
+    title_div = message_div = details_div = None
+    title_link = date_span = author_u = rating_span = language_link = None
+
+    stack = [(child, False, False) for child in reversed(children_of(block))]
+    while stack:
+        node, in_title, in_details = stack.pop()
+        tag = tag_of(node)
+        if tag is None:
+            continue
+        attrs = attrs_of(node)
+
+        if in_title and title_link is None and tag == 'a':
+            title_link = node
+        if in_details:
+            if tag == 'span':
+                if date_span is None and attrs.get('title') is not None:
+                    date_span = node
+                if rating_span is None and (attrs.get('id') or '').startswith('entRating'):
+                    rating_span = node
+            elif tag == 'u' and author_u is None:
+                author_u = node
+            elif tag == 'a' and language_link is None and 'mat' in (attrs.get('href') or ''):
+                language_link = node
+
+        if tag == 'div':
+            classes = (attrs.get('class') or '').split()
+            if title_div is None and 'eTitle' in classes:
+                title_div = node
+                in_title = True
+            if message_div is None and 'eMessage' in classes:
+                message_div = node
+            if details_div is None and 'eDetails' in classes:
+                details_div = node
+                in_details = True
+        stack.extend((child, in_title, in_details) for child in reversed(children_of(node)))
+
+    details_text = text_of(details_div) if details_div is not None else None
+    return _make_block(
+        text_of(title_link) if title_link is not None else None,
+        attrs_of(title_link).get('href') if title_link is not None else None,
+        text_of(message_div).strip() if message_div is not None else None,
+        attrs_of(date_span).get('title') if date_span is not None else None,
+        text_of(author_u) if author_u is not None else None,
+        _views_from_text(details_text) if details_text is not None else None,
+        text_of(rating_span) if rating_span is not None else None,
+        text_of(language_link) if language_link is not None else None,
+    )
+
+
+def _parse_with_lxml(html):
+    document = lxml.html.fromstring(html)
+    # text_content() includes script and style text, which BeautifulSoup's .text skips
+    for node in document.xpath('//script|//style'):
+        node.drop_tree()
+    return [
+        _extract_entry(
+            block,
+            list,
+            lambda node: node.tag if isinstance(node.tag, str) else None,
+            lambda node: node.attrib,
+            lambda node: node.text_content(),
+        )
+        for block in document.xpath("//div[starts-with(@id, 'entryID')]")
+    ]
+
+
+def _selectolax_children(node):
+    children = []
+    child = node.child
+    while child is not None:
+        children.append(child)
+        child = child.next
+    return children
+
+
+def _parse_with_selectolax(html):
+    tree = LexborHTMLParser(html)
+    tree.strip_tags(['script', 'style'])  # text(deep=True) would include their text
+    return [
+        _extract_entry(
+            block,
+            _selectolax_children,
+            lambda node: None if node.tag.startswith('-') else node.tag,
+            lambda node: node.attributes,
+            lambda node: node.text(deep=True),
+        )
+        for block in tree.css('div[id^="entryID"]')
+    ]
+
+
+def parse_html_blocks(html, backend='auto'):
+    """Parse the entry blocks of a board page with the chosen backend"""
+    if backend == 'auto':
+        backend = available_backends()[0]
+    if backend == 'selectolax' and LexborHTMLParser is not None:
+        return _parse_with_selectolax(html)
+    if backend == 'lxml' and lxml is not None:
+        return _parse_with_lxml(html)
+    if backend == 'html.parser':
+        return _parse_with_bs4(html)
+    raise ValueError(f"Parser backend '{backend}' is not available, choose from {available_backends()}")
+
+
+def format_blocks_to_strings(parsed_data):
+    formatted_strings = []
+    for block in parsed_data:
+        main_message_parts = block.get("main_message_parts", [None, None, None])
+        language = block.get("language", "Unknown language")
+
+        if len(main_message_parts) >= 3:
+            formatted_string = (
+                f"{main_message_parts[0]} (произносится {main_message_parts[1]}) – {main_message_parts[2]}. {language}"
+            )
+            formatted_strings.append(formatted_string)
+    return formatted_strings
+
+
+def format_blocks_to_records(parsed_data):
+    """Structured counterpart of format_blocks_to_strings, one record per entry"""
+    records = []
+    for block in parsed_data:
+        main_message_parts = block.get("main_message_parts") or []
+        if len(main_message_parts) >= 3:
+            records.append(make_record(
+                main_message_parts[0], main_message_parts[1], main_message_parts[2], block.get("language") or '',
+            ))
+    return records
@@ -0,0 +1,183 @@
+"""In-process metrics in the Prometheus text exposition format.
+
+Metrics are module-level objects that the hot paths update directly;
+updating one is a dict lookup and an addition, so they stay enabled in
+production. `serve()` exposes them at `/metrics` on a local port:
+
+    METRICS_PORT=9100 python bot.py
+    curl localhost:9100/metrics
+"""
+import bisect
+import os
+import time
+from contextlib import contextmanager
+
+# Seconds; covers a fast in-memory handler up to a slow Telegram round trip
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# HTTP status behind each aiogram exception class, for the error counters
+TELEGRAM_ERROR_CODES = {
+    'TelegramBadRequest': '400',
+    'TelegramUnauthorizedError': '401',
+    'TelegramForbiddenError': '403',
+    'TelegramNotFound': '404',
+    'TelegramConflictError': '409',
+    'TelegramEntityTooLarge': '413',
+    'TelegramRetryAfter': '429',
+    'TelegramServerError': '5xx',
+    'TelegramNetworkError': 'network',
+}
+
+REGISTRY = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labels, key)} {value}"
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # Per-bucket (non-cumulative) counts, then +Inf, sum
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return sum(state[0]) if state else 0
+
+    def _samples(self):
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(self.labels, key, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}"
+
+
+def telegram_error_code(error):
+    """Short code for a Telegram API exception, used as a metric label"""
+    return TELEGRAM_ERROR_CODES.get(type(error).__name__, type(error).__name__)
+
+
+def render():
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+def _process_start_time():
+    """Unix time this process was started, from /proc on Linux, else now"""
+    try:
+        with open('/proc/self/stat') as file:
+            start_ticks = int(file.read().rpartition(')')[2].split()[19])
+        with open('/proc/uptime') as file:
+            uptime = float(file.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.time()
+
+
+PROCESS_START_TIME = _process_start_time()
+
+
+HANDLER_SECONDS = Histogram('bot_handler_seconds', "Time spent in update handlers", ('handler',))
+STORE_SAVE_SECONDS = Histogram('bot_store_save_seconds', "Time to write a batch of changed users to the user store")
+STORE_ERRORS = Counter('bot_store_errors_total', "Failed user store writes")
+WORDLIST_LOAD_SECONDS = Histogram('bot_wordlist_load_seconds', "Time to load one word list", ('list',))
+SEND_SECONDS = Histogram('bot_send_seconds', "Latency of sendMessage calls, including retries", ('result',))
+TELEGRAM_ERRORS = Counter('bot_telegram_errors_total', "Telegram API errors by status code", ('code',))
+SCHEDULER_TICK_SECONDS = Histogram(
+    'bot_scheduler_tick_seconds', "Duration of one delivery round", buckets=DEFAULT_BUCKETS + (30.0, 60.0, 300.0),
+)
+USERS_SERVED = Counter('bot_users_served_total', "Delivery attempts by result", ('result',))
+THROTTLED_UPDATES = Counter('bot_throttled_updates_total', "Updates dropped by per-user rate limits", ('command',))
+STATS_DROPPED = Counter('bot_stats_dropped_total', "Stats events dropped because the buffer was full")
+COALESCED_UPDATES = Counter('bot_coalesced_updates_total', "Repeated updates dropped while an identical one was handled")
+PROCESS_START = Gauge('process_start_time_seconds', "Start time of the process since the Unix epoch")
+PROCESS_START.set(PROCESS_START_TIME)
+STARTUP_SECONDS = Gauge('bot_startup_seconds', "Seconds from process start until each startup stage", ('stage',))
+
+
+def mark_startup(stage):
+    """Record that a startup stage was reached, returns the seconds since process start"""
+    elapsed = time.time() - PROCESS_START_TIME
+    STARTUP_SECONDS.set(elapsed, stage=stage)
+    return elapsed
+
+
+async def handle_metrics(request):
+    from aiohttp import web
+    return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+
+
+async def serve(host='127.0.0.1', port=9100):
+    """Start the /metrics HTTP endpoint, returns the runner to clean up"""
+    from aiohttp import web  # only needed with METRICS_PORT set
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
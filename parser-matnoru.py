@@ -1,123 +1,208 @@
-import requests
-from bs4 import BeautifulSoup
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
 import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from entries import write_tsv
+from matno_parse import BACKENDS, format_blocks_to_records, format_blocks_to_strings, parse_html_blocks
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+}
+
+
+def write_atomic(path, data):
+    """Write bytes or text to `path` through a temporary file"""
+    mode = 'wb' if isinstance(data, bytes) else 'w'
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.tmp-')
+    with os.fdopen(fd, mode, **({} if mode == 'wb' else {'encoding': 'utf-8'})) as file:
+        file.write(data)
+    os.replace(tmp_path, path)
+
+
+class PageCache:
+    """On-disk HTML cache keyed by URL, with the validators needed for conditional GETs.
+
+    `manifest.json` lists the URLs fetched completely; it is rewritten after
+    every page, so an interrupted run resumes from the last finished page.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as file:
+                self.manifest = json.load(file)
+        except FileNotFoundError:
+            self.manifest = {}
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.html')
+
+    def get(self, url):
+        """Return (html, validators) for a cached URL, or (None, None)"""
+        meta = self.manifest.get(url)
+        if meta is None:
+            return None, None
+        try:
+            with open(self._path(url), 'r', encoding='utf-8') as file:
+                return file.read(), meta
+        except FileNotFoundError:
+            return None, None
+
+    def put(self, url, html, etag=None, last_modified=None):
+        write_atomic(self._path(url), html)
+        self.manifest[url] = {'etag': etag, 'last_modified': last_modified, 'fetched_at': time.time()}
+        write_atomic(self.manifest_path, json.dumps(self.manifest, indent=1))
+
+    def touch(self, url):
+        self.manifest[url]['fetched_at'] = time.time()
+        write_atomic(self.manifest_path, json.dumps(self.manifest, indent=1))
+
+
+class HostLimiter:
+    """Limits concurrent requests per host and spaces them by `delay` seconds"""
+
+    def __init__(self, concurrency, delay):
+        self.concurrency = concurrency
+        self.delay = delay
+        self._semaphores = {}
+        self._next_slot = {}
+
+    async def __call__(self, host, request):
+        semaphore = self._semaphores.setdefault(host, asyncio.Semaphore(self.concurrency))
+        async with semaphore:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, 0.0))
+            self._next_slot[host] = slot + self.delay
+            if slot > now:
+                await asyncio.sleep(slot - now)
+            return await request()
+
+
+async def fetch_html_from_url(session, url, cache, limiter, revalidate=False, retries=3):
+    """Fetch a page through the cache.
+
+    Pages already in the cache are reused as is unless `revalidate` is set,
+    in which case a conditional GET is sent with the stored ETag and
+    Last-Modified values.
+    """
+    html, meta = cache.get(url)
+    if html is not None and not revalidate:
+        return html, 'cached'
+
+    headers = dict(HEADERS)
+    if html is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    async def request():
+        async with session.get(url, headers=headers) as response:
+            if response.status == 304 and html is not None:
+                return response.status, None, response.headers
+            if response.status != 200:
+                raise Exception(f"Failed to fetch HTML from {url}, status code: {response.status}")
+            return response.status, await response.text(), response.headers
+
+    for attempt in range(retries + 1):
+        try:
+            status, text, response_headers = await limiter(urlsplit(url).netloc, request)
+            break
+        except Exception as e:
+            if attempt == retries:
+                raise
+            logging.warning(f"{e}, retrying")
+            await asyncio.sleep(2 ** attempt)
+
+    if status == 304:
+        cache.touch(url)
+        return html, 'not modified'
+    cache.put(url, text, response_headers.get('ETag'), response_headers.get('Last-Modified'))
+    return text, 'fetched'
+
+
+async def fetch_and_parse_pages(base_url, page_count, cache, concurrency=2, delay=1.0, revalidate=False,
+                                backend='auto'):
+    """Fetch all pages concurrently, returns (parsed blocks in page order, failed urls)"""
+    limiter = HostLimiter(concurrency, delay)
+    urls = [f"{base_url}?page{page}" for page in range(1, page_count + 1)]
+    results = {}
+    failed = []
+
+    async with aiohttp.ClientSession() as session:
+        async def fetch_page(url):
+            try:
+                html, source = await fetch_html_from_url(session, url, cache, limiter, revalidate)
+                print(f"{source}: {url}")
+                results[url] = parse_html_blocks(html, backend)
+            except Exception as e:
+                logging.error(f"Giving up on {url}: {e}")
+                failed.append(url)
+
+        await asyncio.gather(*(fetch_page(url) for url in urls))
 
-def fetch_html_from_url(url):
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-    }
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        return response.text
-    else:
-        raise Exception(f"Failed to fetch HTML from {url}, status code: {response.status_code}")
-
-def parse_html_blocks(html):
-    soup = BeautifulSoup(html, 'html.parser')
-
-    # Find all blocks with a specific ID pattern or class
-    blocks = soup.find_all('div', id=lambda x: x and x.startswith('entryID'))
-
-    parsed_blocks = []
-
-    for block in blocks:
-        # Extract the title and link from the eTitle div
-        title_div = block.find('div', class_='eTitle')
-        title = title_div.a.text if title_div and title_div.a else None
-        link = title_div.a['href'] if title_div and title_div.a and 'href' in title_div.a.attrs else None
-
-        # Extract the main message
-        message_div = block.find('div', class_='eMessage')
-        main_message = message_div.text.strip() if message_div else None
-
-        # Remove "Пример употребления" and "Примечание" sections from the main message
-        if main_message:
-            main_message = main_message.split("Пример употребления:")[0]
-            main_message = main_message.split("Примечание:")[0].strip()
-
-        # Split the main message into separate strings if it exists
-        main_message_parts = None
-        if main_message:
-            main_message_parts = [part.strip() for part in main_message.split('|')]
-
-        # Extract additional details like rating, date, author, views, and language
-        details_div = block.find('div', class_='eDetails')
-
-        # Extract date
-        date_span = details_div.find('span', title=True) if details_div else None
-        date = date_span['title'] if date_span and 'title' in date_span.attrs else None
-
-        # Extract author
-        author = details_div.find('u').text if details_div and details_div.find('u') else None
-
-        # Extract views
-        views = None
-        if details_div:
-            views_text = details_div.text
-            views_start = views_text.find("Прочитали:")
-            if views_start != -1:
-                views = views_text[views_start:].split('|')[0].replace("Прочитали:", "").strip()
-
-        # Extract rating
-        rating_span = details_div.find('span', id=lambda x: x and x.startswith('entRating')) if details_div else None
-        rating = rating_span.text if rating_span else None
-
-        # Extract language
-        language_link = details_div.find('a', href=lambda x: x and 'mat' in x) if details_div else None
-        language = language_link.text if language_link else None
-
-        # Append parsed block to the list
-        parsed_blocks.append({
-            "title": title,
-            "link": link,
-            "main_message": main_message,
-            "main_message_parts": main_message_parts,
-            "date": date,
-            "author": author,
-            "views": views,
-            "rating": rating,
-            "language": language,
-        })
-
-    return parsed_blocks
-
-def fetch_and_parse_pages(base_url, page_count):
     all_parsed_data = []
-    for page in range(1, page_count + 1):
-        url = f"{base_url}?page{page}"
-        print(f"Fetching URL: {url}")
-        time.sleep(2)  # Wait 2 seconds between requests to reduce suspicion
-        html_page = fetch_html_from_url(url)
-        parsed_data = parse_html_blocks(html_page)
-        all_parsed_data.extend(parsed_data)
-    return all_parsed_data
-
-def format_blocks_to_strings(parsed_data):
-    formatted_strings = []
-    for block in parsed_data:
-        main_message_parts = block.get("main_message_parts", [None, None, None])
-        language = block.get("language", "Unknown language")
-
-        if len(main_message_parts) >= 3:
-            formatted_string = (
-                f"{main_message_parts[0]} (произносится {main_message_parts[1]}) – {main_message_parts[2]}. {language}"
-            )
-            formatted_strings.append(formatted_string)
-    return formatted_strings
+    for url in urls:
+        all_parsed_data.extend(results.get(url, []))
+    return all_parsed_data, failed
+
 
 def save_strings_to_file(strings, filename):
     with open(filename, "w", encoding="utf-8") as file:
         for string in strings:
             file.write(string + "\n")
 
-# Example usage with URL
-base_url = 'https://matno.ru/board/'
-parsed_data = fetch_and_parse_pages(base_url, 79)
-
-# Format parsed data to strings
-formatted_strings = format_blocks_to_strings(parsed_data)
-
-# Save formatted strings to a text file
-save_strings_to_file(formatted_strings, "output.txt")
 
-print("Formatted strings have been saved to output.txt")
\ No newline at end of file
+def main():
+    parser = argparse.ArgumentParser(description="Scrape matno.ru into a word list")
+    parser.add_argument('--base-url', default='https://matno.ru/board/')
+    parser.add_argument('--pages', type=int, default=79)
+    parser.add_argument('--output', default='output.txt')
+    parser.add_argument('--format', choices=('txt', 'tsv'),
+                        help="plain lines or structured records, defaults to the output file's extension")
+    parser.add_argument('--cache-dir', default='.cache/matno')
+    parser.add_argument('--concurrency', type=int, default=2, help="parallel requests per host")
+    parser.add_argument('--delay', type=float, default=1.0, help="seconds between requests to one host")
+    parser.add_argument('--revalidate', action='store_true',
+                        help="re-check cached pages with conditional requests instead of reusing them")
+    parser.add_argument('--parser', default='auto', choices=('auto',) + BACKENDS,
+                        help="HTML parser backend, 'auto' picks the fastest installed one")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    cache = PageCache(args.cache_dir)
+    parsed_data, failed = asyncio.run(fetch_and_parse_pages(
+        args.base_url, args.pages, cache, args.concurrency, args.delay, args.revalidate, args.parser,
+    ))
+    if failed:
+        print(f"{len(failed)} pages failed, run again to resume: {', '.join(failed)}")
+        sys.exit(1)
+
+    if (args.format or os.path.splitext(args.output)[1].lstrip('.')) == 'tsv':
+        with open(args.output, "w", encoding="utf-8") as file:
+            write_tsv(file, format_blocks_to_records(parsed_data))
+        print(f"Records have been saved to {args.output}")
+        return
+
+    # Format parsed data to strings
+    formatted_strings = format_blocks_to_strings(parsed_data)
+
+    # Save formatted strings to a text file
+    save_strings_to_file(formatted_strings, args.output)
+
+    print(f"Formatted strings have been saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
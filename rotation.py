@@ -0,0 +1,58 @@
+import random
+
+ROUNDS = 3
+
+
+def _round_keys(seed):
+    keys = []
+    for _ in range(ROUNDS):
+        seed = (seed * 6364136223846793005 + 1442695040888963407) & 0xFFFFFFFFFFFFFFFF
+        keys.append(seed >> 33)
+    return keys
+
+
+def permute(index, seed, bits):
+    """Bijection of [0, 2**bits) selected by `seed`.
+
+    Every step (odd multiply, xor with own high half, add) is invertible
+    modulo 2**bits, so the composition visits each value exactly once.
+    """
+    mask = (1 << bits) - 1
+    shift = (bits + 1) // 2 or 1
+    x = index
+    for key in _round_keys(seed):
+        x = (x * (key | 1)) & mask
+        x ^= x >> shift
+        x = (x + key) & mask
+    return x
+
+
+def domain_bits(size):
+    return max(size - 1, 0).bit_length()
+
+
+def new_cycle(size, rng=random):
+    return [rng.getrandbits(32), 0, domain_bits(size)]
+
+
+def next_index(state, size, rng=random):
+    """Next word index for a list of `size` entries, returns (index, new_state).
+
+    `state` is `[seed, cursor, bits]`: a position in a pseudo-random
+    permutation of [0, 2**bits) where indices >= `size` are skipped. No
+    index repeats until the cycle is exhausted. When the list shrinks the
+    missing indices are skipped; when it grows within the same power of two
+    the new entries join the current cycle, otherwise a new cycle starts.
+    """
+    if size <= 0:
+        raise ValueError("Cannot rotate through an empty list")
+    if not state or size > (1 << state[2]):
+        state = new_cycle(size, rng)
+    seed, cursor, bits = state
+    while True:
+        while cursor < (1 << bits):
+            index = permute(cursor, seed, bits)
+            cursor += 1
+            if index < size:
+                return index, [seed, cursor, bits]
+        seed, cursor, bits = new_cycle(size, rng)
@@ -0,0 +1,194 @@
+import asyncio
+import functools
+import heapq
+import logging
+import time
+from datetime import datetime, time as dt_time, timedelta
+
+import pytz
+
+from metrics import SCHEDULER_TICK_SECONDS
+
+
+BUCKET_SECONDS = 60
+
+
+@functools.lru_cache(maxsize=None)
+def _zone_names():
+    # Built on the first /time rather than at import, it lists every zone pytz knows
+    return {name.lower(): name for name in pytz.all_timezones}
+
+
+class DueQueue:
+    """Users grouped into per-minute buckets of their next due time (epoch seconds).
+
+    A user due at any second of a minute is handed out when that minute
+    ends, together with everyone else in the bucket, so a wakeup touches
+    only the bucket that became due. A heap orders the bucket keys;
+    keys of buckets emptied by cancellations are skipped when they surface.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._buckets = {}  # bucket -> set of user ids
+        self._bucket_of = {}  # user id -> bucket
+
+    def __len__(self):
+        return len(self._bucket_of)
+
+    def __contains__(self, user_id):
+        return user_id in self._bucket_of
+
+    @staticmethod
+    def _bucket(due):
+        return -int(-due // BUCKET_SECONDS)
+
+    def due_time(self, user_id):
+        bucket = self._bucket_of.get(user_id)
+        return None if bucket is None else bucket * BUCKET_SECONDS
+
+    def schedule(self, user_id, due):
+        self.cancel(user_id)
+        bucket = self._bucket(due)
+        users = self._buckets.get(bucket)
+        if users is None:
+            users = self._buckets[bucket] = set()
+            heapq.heappush(self._heap, bucket)
+        users.add(user_id)
+        self._bucket_of[user_id] = bucket
+
+    def cancel(self, user_id):
+        bucket = self._bucket_of.pop(user_id, None)
+        if bucket is None:
+            return
+        users = self._buckets[bucket]
+        users.discard(user_id)
+        if not users:
+            del self._buckets[bucket]
+            if len(self._heap) > 64 and len(self._heap) > 2 * len(self._buckets):
+                self._heap = list(self._buckets)
+                heapq.heapify(self._heap)
+
+    def next_due(self):
+        """Due time of the earliest bucket, or None if the queue is empty"""
+        heap = self._heap
+        while heap and heap[0] not in self._buckets:
+            heapq.heappop(heap)
+        return heap[0] * BUCKET_SECONDS if heap else None
+
+    def pop_due(self, now):
+        """Remove and return every user in buckets due at or before `now`"""
+        due_users = []
+        heap = self._heap
+        while heap and heap[0] * BUCKET_SECONDS <= now:
+            users = self._buckets.pop(heapq.heappop(heap), None)
+            if users:
+                for user_id in users:
+                    del self._bucket_of[user_id]
+                due_users.extend(users)
+        return due_users
+
+
+def parse_time_of_day(text):
+    """Minutes after midnight for "HH:MM", or None if it is not a valid time"""
+    hours, separator, minutes = text.partition(':')
+    if not (separator and hours.isdigit() and minutes.isdigit() and len(minutes) == 2):
+        return None
+    hours, minutes = int(hours), int(minutes)
+    if hours > 23 or minutes > 59:
+        return None
+    return hours * 60 + minutes
+
+
+def find_timezone(name):
+    """pytz timezone for an IANA name, matched case-insensitively, or None"""
+    zone_name = _zone_names().get(name.lower())
+    return pytz.timezone(zone_name) if zone_name else None
+
+
+def format_schedule(minute_of_day, tz):
+    return f"{minute_of_day // 60:02d}:{minute_of_day % 60:02d} {tz.zone}"
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_schedule(schedule):
+    """(minute of day, pytz timezone) of a stored "HH:MM Area/City" schedule, None if unset or invalid"""
+    if not schedule:
+        return None
+    time_text, _, zone_name = schedule.partition(' ')
+    minute_of_day = parse_time_of_day(time_text)
+    tz = find_timezone(zone_name)
+    if minute_of_day is None or tz is None:
+        return None
+    return minute_of_day, tz
+
+
+def localize(tz, naive):
+    """Attach `tz` to a local wall-clock time, resolving DST transitions.
+
+    A time skipped when clocks go forward maps to the same offset after
+    the jump (02:30 becomes 03:30); a time repeated when clocks go back
+    maps to its first occurrence.
+    """
+    try:
+        return tz.localize(naive, is_dst=None)
+    except pytz.NonExistentTimeError:
+        return tz.normalize(tz.localize(naive, is_dst=False))
+    except pytz.AmbiguousTimeError:
+        return tz.localize(naive, is_dst=True)
+
+
+def next_local_time(minute_of_day, tz, after):
+    """First moment after the aware datetime `after` whose local time in `tz` is `minute_of_day`"""
+    local_date = after.astimezone(tz).date()
+    hours, minutes = divmod(minute_of_day, 60)
+    for days in range(3):
+        naive = datetime.combine(local_date + timedelta(days=days), dt_time(hours, minutes))
+        candidate = localize(tz, naive)
+        if candidate > after:
+            return candidate
+    raise ValueError(f"No {hours:02d}:{minutes:02d} in {tz} after {after}")
+
+
+class DeliveryScheduler:
+    """Sleeps until the earliest user is due, then hands the due users to `deliver`"""
+
+    def __init__(self, deliver, retry_delay=600):
+        self.deliver = deliver
+        self.retry_delay = retry_delay  # seconds before users of a failed `deliver` call are due again
+        self.queue = DueQueue()
+        self._wakeup = None
+
+    def schedule(self, user_id, due):
+        earliest = self.queue.next_due()
+        self.queue.schedule(user_id, due)
+        if self._wakeup is not None and (earliest is None or self.queue.due_time(user_id) < earliest):
+            self._wakeup.set()
+
+    def cancel(self, user_id):
+        self.queue.cancel(user_id)
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            next_due = self.queue.next_due()
+            delay = None if next_due is None else next_due - time.time()
+            if delay is None or delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due_users = self.queue.pop_due(time.time())
+            try:
+                with SCHEDULER_TICK_SECONDS.time():
+                    await self.deliver(due_users)
+            except Exception as e:
+                logging.error(f"Delivery of {len(due_users)} users failed: {e}")
+                # Users `deliver` got to were rescheduled already, the rest are retried
+                retry_at = time.time() + self.retry_delay
+                for user_id in due_users:
+                    if user_id not in self.queue:
+                        self.queue.schedule(user_id, retry_at)
@@ -0,0 +1,64 @@
+from array import array
+from bisect import bisect_left
+
+NGRAM = 3
+
+
+def fold(text):
+    """Case-fold text for matching; also treats Cyrillic 'ё' as 'е'"""
+    return text.casefold().replace('ё', 'е')
+
+
+class WordIndex:
+    """Prefix and substring index over the entries of one word list.
+
+    Prefixes are answered by bisecting the sorted folded entries; substrings
+    of at least NGRAM characters by checking only the entries listed under
+    the query's rarest trigram.
+    """
+
+    def __init__(self, words):
+        self.folded = [fold(word) for word in words]
+        order = sorted(range(len(self.folded)), key=self.folded.__getitem__)
+        self.sorted_keys = [self.folded[i] for i in order]
+        self.sorted_ids = array('I', order)
+
+        postings = {}
+        for i, text in enumerate(self.folded):
+            for gram in {text[j:j + NGRAM] for j in range(len(text) - NGRAM + 1)}:
+                postings.setdefault(gram, array('I')).append(i)
+        self.postings = postings
+
+    def prefix(self, query, limit=20):
+        """Indices of entries starting with `query`, in sorted order"""
+        query = fold(query)
+        keys = self.sorted_keys
+        results = []
+        position = bisect_left(keys, query)
+        while position < len(keys) and len(results) < limit and keys[position].startswith(query):
+            results.append(self.sorted_ids[position])
+            position += 1
+        return results
+
+    def substring(self, query, limit=20):
+        """Indices of entries containing `query`, in list order"""
+        query = fold(query)
+        if len(query) < NGRAM:
+            return []
+        grams = {query[j:j + NGRAM] for j in range(len(query) - NGRAM + 1)}
+        candidates = min((self.postings.get(gram, ()) for gram in grams), key=len)
+        results = []
+        for i in candidates:
+            if query in self.folded[i]:
+                results.append(i)
+                if len(results) >= limit:
+                    break
+        return results
+
+    def search(self, query, limit=20):
+        """Prefix matches first, then other substring matches"""
+        results = self.prefix(query, limit)
+        if len(results) < limit:
+            seen = set(results)
+            results.extend(i for i in self.substring(query, limit) if i not in seen)
+        return results[:limit]
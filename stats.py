@@ -0,0 +1,224 @@
+"""Engagement statistics: an append-only event log compacted into daily rollups.
+
+Delivery and handlers call `StatsLog.record()`, which only appends to an
+in-memory buffer; `flush_due()` writes it in one transaction once
+`max_pending` events are waiting or the oldest is `max_delay` seconds old,
+and `flush()` writes it at once. Events arriving while `max_buffered` are
+waiting, say while the database is unavailable, are dropped and counted in
+`bot_stats_dropped_total`. Tables in the stats database:
+
+* `events`: one row per event of a day (UTC) not compacted yet, in
+  practice today's,
+* `daily_counts`, `daily_active`: events per day, kind and list, and
+  distinct users per day, compacted from `events` once the day is over
+  and kept for `retention_days`,
+* `user_totals`: lifetime events per user, list and kind,
+* `word_counts`: lifetime deliveries per list and headword.
+
+The last two are updated with every flush. Reports read at most
+`retention_days` rollup rows, one day of events and the fixed-size
+totals, so they take the same time however long the bot has run.
+"""
+import logging
+import sqlite3
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from metrics import STATS_DROPPED
+
+DELIVERED = 'delivered'  # A scheduled word (or the first one after /start)
+SKIPPED = 'skipped'  # An extra word sent for /skip
+SUBSCRIBED = 'subscribed'
+UNSUBSCRIBED = 'unsubscribed'
+WORD_KINDS = (DELIVERED, SKIPPED)
+
+
+def today():
+    """Current UTC day as a date ordinal"""
+    return datetime.now(timezone.utc).date().toordinal()
+
+
+class StatsLog:
+    def __init__(self, path, max_pending=1000, max_delay=1.0, retention_days=90, max_buffered=100000):
+        self.path = path
+        self.max_pending = max_pending
+        self.max_buffered = max_buffered
+        self.max_delay = max_delay
+        self.retention_days = retention_days
+        self.pending = []
+        self._pending_since = None
+        self._conn = None
+        self.compacted_day = None
+
+    @property
+    def conn(self):
+        # Connected on first use so importing the bot stays free of I/O
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                " day INTEGER NOT NULL, user_id INTEGER NOT NULL, kind TEXT NOT NULL, list TEXT NOT NULL, word TEXT"
+                ")"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS events_day ON events (day)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS daily_counts ("
+                " day INTEGER, kind TEXT, list TEXT, count INTEGER NOT NULL, PRIMARY KEY (day, kind, list)"
+                ")"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS daily_active (day INTEGER PRIMARY KEY, users INTEGER NOT NULL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_totals ("
+                " user_id INTEGER, list TEXT, kind TEXT, count INTEGER NOT NULL, PRIMARY KEY (user_id, list, kind)"
+                ")"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS word_counts ("
+                " list TEXT, word TEXT, count INTEGER NOT NULL, PRIMARY KEY (list, word)"
+                ")"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS word_counts_count ON word_counts (count)")
+            self._conn = conn
+        return self._conn
+
+    def record(self, kind, user_id, list_name='', word=None):
+        """Queue one event; never touches the database, drops the event if the buffer is full"""
+        if len(self.pending) >= self.max_buffered:
+            STATS_DROPPED.inc()
+            return
+        if not self.pending:
+            self._pending_since = time.monotonic()
+        self.pending.append((today(), user_id, kind, list_name, word))
+
+    def flush(self):
+        """Write every buffered event now"""
+        if not self.pending:
+            return True
+        events, self.pending, self._pending_since = self.pending, [], None
+        user_totals = Counter((user_id, list_name, kind) for _, user_id, kind, list_name, _ in events)
+        word_counts = Counter(
+            (list_name, word) for _, _, kind, list_name, word in events if word is not None and kind in WORD_KINDS
+        )
+        try:
+            with self.conn:
+                self.conn.execute("BEGIN")
+                self.conn.executemany("INSERT INTO events (day, user_id, kind, list, word) VALUES (?, ?, ?, ?, ?)", events)
+                self.conn.executemany(
+                    "INSERT INTO user_totals (user_id, list, kind, count) VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT (user_id, list, kind) DO UPDATE SET count = count + excluded.count",
+                    [(*key, count) for key, count in user_totals.items()],
+                )
+                self.conn.executemany(
+                    "INSERT INTO word_counts (list, word, count) VALUES (?, ?, ?)"
+                    " ON CONFLICT (list, word) DO UPDATE SET count = count + excluded.count",
+                    [(*key, count) for key, count in word_counts.items()],
+                )
+            return True
+        except sqlite3.Error as e:
+            logging.error(f"Error writing {len(events)} stats events: {e}")
+            self.pending[:0] = events  # retried with the next flush
+            overflow = len(self.pending) - self.max_buffered
+            if overflow > 0:
+                del self.pending[self.max_buffered:]
+                STATS_DROPPED.inc(overflow)
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            return False
+
+    def flush_due(self):
+        """Write buffered events once `max_pending` wait or the oldest is `max_delay` seconds old; compact after midnight"""
+        if self.pending and (
+            len(self.pending) >= self.max_pending or time.monotonic() - self._pending_since >= self.max_delay
+        ):
+            self.flush()
+        if self.compacted_day != today():
+            self.compact()
+
+    def compact(self):
+        """Roll the events of finished days up into daily rows, drop rows past the retention window"""
+        day = today()
+        try:
+            with self.conn:
+                self.conn.execute("BEGIN IMMEDIATE")
+                self.conn.execute(
+                    "INSERT INTO daily_counts (day, kind, list, count)"
+                    " SELECT day, kind, list, COUNT(*) FROM events WHERE day < ? GROUP BY day, kind, list"
+                    " ON CONFLICT (day, kind, list) DO UPDATE SET count = count + excluded.count",
+                    (day,),
+                )
+                # Another process may flush a few events of a day after it was compacted;
+                # their users are not counted twice, at the cost of possibly missing some
+                self.conn.execute(
+                    "INSERT INTO daily_active (day, users)"
+                    " SELECT day, COUNT(DISTINCT user_id) FROM events WHERE day < ? GROUP BY day"
+                    " ON CONFLICT (day) DO UPDATE SET users = MAX(users, excluded.users)",
+                    (day,),
+                )
+                self.conn.execute("DELETE FROM events WHERE day < ?", (day,))
+                self.conn.execute("DELETE FROM daily_counts WHERE day < ?", (day - self.retention_days,))
+                self.conn.execute("DELETE FROM daily_active WHERE day < ?", (day - self.retention_days,))
+        except sqlite3.Error as e:
+            logging.error(f"Error compacting stats: {e}")
+            return False
+        self.compacted_day = day
+        return True
+
+    def user_report(self, user_id):
+        """{list: {kind: count}} of a user's lifetime events"""
+        self.flush()
+        report = {}
+        for list_name, kind, count in self.conn.execute(
+            "SELECT list, kind, count FROM user_totals WHERE user_id = ?", (user_id,)
+        ):
+            report.setdefault(list_name, {})[kind] = count
+        return report
+
+    def daily_report(self, days):
+        """[(day, Counter of events by kind, active users)] for the last `days` days, oldest first"""
+        self.flush()
+        first = today() - days + 1
+        counts = {day: Counter() for day in range(first, first + days)}
+        active = dict.fromkeys(counts, 0)
+        for table in ('daily_counts', 'events'):
+            column = 'SUM(count)' if table == 'daily_counts' else 'COUNT(*)'
+            for day, kind, count in self.conn.execute(
+                f"SELECT day, kind, {column} FROM {table} WHERE day >= ? GROUP BY day, kind", (first,)
+            ):
+                if day in counts:
+                    counts[day][kind] += count
+        for day, users in self.conn.execute(
+            "SELECT day, users FROM daily_active WHERE day >= ?"
+            " UNION ALL SELECT day, COUNT(DISTINCT user_id) FROM events WHERE day >= ? GROUP BY day",
+            (first, first),
+        ):
+            if day in active:
+                active[day] = max(active[day], users)
+        return [(day, counts[day], active[day]) for day in counts]
+
+    def list_report(self, days):
+        """{list: Counter of word events by kind} over the last `days` days"""
+        self.flush()
+        first = today() - days + 1
+        report = {}
+        for list_name, kind, count in self.conn.execute(
+            "SELECT list, kind, SUM(count) FROM daily_counts WHERE day >= ? AND kind IN (?, ?) GROUP BY list, kind"
+            " UNION ALL"
+            " SELECT list, kind, COUNT(*) FROM events WHERE day >= ? AND kind IN (?, ?) GROUP BY list, kind",
+            (first, *WORD_KINDS, first, *WORD_KINDS),
+        ):
+            report.setdefault(list_name, Counter())[kind] += count
+        return report
+
+    def top_words(self, limit=10):
+        """[(list, headword, deliveries)] of the most delivered entries"""
+        self.flush()
+        return self.conn.execute(
+            "SELECT list, word, count FROM word_counts ORDER BY count DESC LIMIT ?", (limit,)
+        ).fetchall()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
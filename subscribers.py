@@ -0,0 +1,207 @@
+import logging
+import time
+
+from metrics import STORE_ERRORS, STORE_SAVE_SECONDS
+from user_store import ACTIVE, LISTS, SCHEDULE, SENT
+from rotation import next_index
+
+
+class SubscriberRegistry:
+    """Authoritative in-memory view of subscribers.
+
+    Filled from a UserStore by `load()` at startup; every mutation updates the
+    in-memory dicts and writes the affected user to the store. Callables in
+    `listeners` are called with the user id whenever a user's subscription
+    or last word time changes.
+
+    With `max_pending` set, writes are buffered (write-behind): changed
+    users are written in one batch once `max_pending` of them are waiting
+    or the oldest has waited `max_delay` seconds (see `flush_due`), and
+    whenever `flush_pending` is called. A crash loses at most that window.
+    """
+
+    def __init__(self, store, default_lists, max_pending=0, max_delay=1.0):
+        self.store = store
+        self.default_lists = list(default_lists)
+        self.listeners = []
+        self.max_pending = max_pending
+        self.max_delay = max_delay
+        self.pending = {}  # user id -> changed parts of the record, see UserStore.save_users
+        self._pending_since = None
+        self.seq = None
+        self.active_users = {}
+        self.user_lists = {}
+        self.rotations = {}
+        self.schedules = {}
+
+    def load(self, store=None):
+        """Read the whole state from the store, or from `store` which then replaces it"""
+        if store is not None:
+            self.store = store
+        self.seq = self.store.last_change() if self.store.supports_changes else None
+        state = self.store.load()
+        self.active_users = state['active_users']
+        self.user_lists = state['user_lists']
+        self.rotations = state['rotations']
+        self.schedules = state['schedules']
+        logging.info(f"Loaded {len(self.active_users)} active users, {len(self.user_lists)} with list preferences")
+
+    def __len__(self):
+        return len(self.active_users)
+
+    def is_known(self, user_id):
+        return user_id in self.active_users or user_id in self.user_lists
+
+    def is_active(self, user_id):
+        return user_id in self.active_users
+
+    def active_user_ids(self):
+        return list(self.active_users)
+
+    def last_word_time(self, user_id):
+        return self.active_users.get(user_id)
+
+    def lists_for(self, user_id):
+        return self.user_lists.get(user_id, self.default_lists)
+
+    def _record(self, user_id):
+        return (
+            user_id,
+            user_id in self.active_users,
+            self.active_users.get(user_id),
+            self.user_lists.get(user_id),
+            self.rotations.get(user_id),
+            self.schedules.get(user_id),
+        )
+
+    def _save(self, changes):
+        try:
+            with STORE_SAVE_SECONDS.time():
+                self.store.save_users([(self._record(user_id), parts) for user_id, parts in changes.items()])
+            return True
+        except Exception as e:
+            STORE_ERRORS.inc()
+            logging.error(f"Error saving {len(changes)} users: {e}")
+            if self.max_pending:
+                self._buffer(changes)  # retried with the next batch
+            return False
+
+    def _buffer(self, changes):
+        if not self.pending:
+            self._pending_since = time.monotonic()
+        for user_id, parts in changes.items():
+            self.pending.setdefault(user_id, set()).update(parts)
+
+    def flush(self, user_id, *parts):
+        """Write the changed parts of a user's state to the store, or queue them with write-behind on"""
+        if not self.max_pending:
+            return self._save({user_id: set(parts)})
+        self._buffer({user_id: parts})
+        if len(self.pending) >= self.max_pending:
+            return self.flush_pending()
+        return True
+
+    def flush_pending(self):
+        """Write every buffered user now"""
+        if not self.pending:
+            return True
+        changes, self.pending, self._pending_since = self.pending, {}, None
+        return self._save(changes)
+
+    def flush_due(self):
+        """Write buffered users if the oldest has waited `max_delay` seconds"""
+        if self.pending and time.monotonic() - self._pending_since >= self.max_delay:
+            return self.flush_pending()
+        return True
+
+    def sync(self):
+        """Apply the writes other processes made to a shared store since the last sync.
+
+        Our own writes come back too and are applied again, which is
+        harmless. Buffered writes go out first so they are not overwritten.
+        Returns the ids of the changed users.
+        """
+        if not self.store.supports_changes:
+            return []
+        self.flush_pending()
+        state, user_ids, self.seq = self.store.changes_since(self.seq)
+        for user_id in user_ids:
+            for key, values in (('active_users', self.active_users),
+                                ('user_lists', self.user_lists),
+                                ('rotations', self.rotations),
+                                ('schedules', self.schedules)):
+                if user_id in state[key]:
+                    values[user_id] = state[key][user_id]
+                else:
+                    values.pop(user_id, None)
+            self._notify(user_id)
+        return user_ids
+
+    def _notify(self, user_id):
+        for listener in self.listeners:
+            listener(user_id)
+
+    def next_word_index(self, user_id, list_name, size):
+        """Advance the user's non-repeating walk through a list of `size` words.
+
+        The new position is kept in memory and persisted with the next flush.
+        """
+        rotation = self.rotations.setdefault(user_id, {})
+        index, rotation[list_name] = next_index(rotation.get(list_name), size)
+        return index
+
+    def subscribe(self, user_id):
+        """Activate a user, keeping their lists if they had any"""
+        self.active_users.setdefault(user_id, None)
+        self.user_lists.setdefault(user_id, list(self.default_lists))
+        saved = self.flush(user_id, ACTIVE)
+        self._notify(user_id)
+        return saved
+
+    def unsubscribe(self, user_id):
+        if user_id not in self.active_users:
+            return False
+        del self.active_users[user_id]
+        saved = self.flush(user_id, ACTIVE)
+        self._notify(user_id)
+        return saved
+
+    def mark_sent(self, user_id, when):
+        """Record a delivery; returns False without reactivating a user who unsubscribed meanwhile"""
+        if user_id not in self.active_users:
+            return False
+        self.active_users[user_id] = when
+        saved = self.flush(user_id, SENT)
+        self._notify(user_id)
+        return saved
+
+    def schedule_for(self, user_id):
+        return self.schedules.get(user_id)
+
+    def set_schedule(self, user_id, schedule):
+        """Set the user's "HH:MM Area/City" delivery time, None for the default interval"""
+        if schedule is None:
+            self.schedules.pop(user_id, None)
+        else:
+            self.schedules[user_id] = schedule
+        saved = self.flush(user_id, SCHEDULE)
+        self._notify(user_id)
+        return saved
+
+    def add_list(self, user_id, list_name):
+        """Add a list to a user's selection, returns False if already there"""
+        lists = self.user_lists.setdefault(user_id, list(self.default_lists))
+        if list_name in lists:
+            return False
+        lists.append(list_name)
+        self.flush(user_id, LISTS)
+        return True
+
+    def remove_list(self, user_id, list_name):
+        lists = self.user_lists.setdefault(user_id, list(self.default_lists))
+        if list_name not in lists:
+            return False
+        lists.remove(list_name)
+        self.rotations.get(user_id, {}).pop(list_name, None)
+        self.flush(user_id, LISTS)
+        return True
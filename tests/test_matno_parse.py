@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+from matno_parse import available_backends, format_blocks_to_strings, parse_html_blocks
+
+# Also served by bench/matno_stub.py: python bench/matno_stub.py tests/fixtures/
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'page1.html')
+
+
+@pytest.fixture(scope='module')
+def html():
+    with open(FIXTURE, encoding='utf-8') as file:
+        return file.read()
+
+
+def test_reference_backend(html):
+    assert format_blocks_to_strings(parse_html_blocks(html, 'html.parser')) == [
+        'fuck (произносится фак) – трахаться. Английский',
+        'Scheiße (произносится шайсэ) – дерьмо & ерунда. Немецкий',
+        'joder (произносится хóдэр) – чёрт побери. Испанский',
+    ]
+
+
+@pytest.mark.parametrize('backend', available_backends())
+def test_backends_agree(html, backend):
+    expected = parse_html_blocks(html, 'html.parser')
+    blocks = parse_html_blocks(html, backend)
+    assert format_blocks_to_strings(blocks) == format_blocks_to_strings(expected)
+    assert blocks == expected
@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+from rotation import next_index
+
+
+def draw(state, size, count, rng):
+    indices = []
+    for _ in range(count):
+        index, state = next_index(state, size, rng)
+        indices.append(index)
+    return indices, state
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 8, 9, 100, 1000])
+def test_full_cycle_visits_every_index_once(size):
+    rng = random.Random(size)
+    indices, state = draw(None, size, size, rng)
+    assert sorted(indices) == list(range(size))
+    # The next cycle covers the list again
+    indices, _ = draw(state, size, size, rng)
+    assert sorted(indices) == list(range(size))
+
+
+def test_shrink_skips_missing_indices():
+    rng = random.Random(1)
+    seen, state = draw(None, 100, 30, rng)
+    rest, _ = draw(state, 60, 60 - len([i for i in seen if i < 60]), rng)
+    assert all(index < 60 for index in rest)
+    assert sorted(rest + [i for i in seen if i < 60]) == list(range(60))
+
+
+def test_grow_within_cycle_continues_it():
+    rng = random.Random(2)
+    seen, state = draw(None, 100, 30, rng)  # cycle over 128 slots
+    seed = state[0]
+    while True:
+        index, state = next_index(state, 120, rng)
+        if state[0] != seed:
+            break
+        seen.append(index)
+    # New entries join the rest of the cycle, nothing repeats before it ends
+    assert len(seen) == len(set(seen))
+    assert set(range(100)) <= set(seen)
+    assert any(index >= 100 for index in seen)
+
+
+def test_grow_past_cycle_starts_new_cycle():
+    rng = random.Random(3)
+    _, state = draw(None, 10, 5, rng)  # cycle over 16 slots
+    indices, _ = draw(state, 40, 40, rng)
+    assert sorted(indices) == list(range(40))
+
+
+def test_empty_list():
+    with pytest.raises(ValueError):
+        next_index(None, 0)
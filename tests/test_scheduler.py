@@ -0,0 +1,119 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from scheduler import BUCKET_SECONDS, DeliveryScheduler, DueQueue, localize, next_local_time
+
+BERLIN = pytz.timezone('Europe/Berlin')
+
+
+def test_localize_spring_forward():
+    # 2026-03-29 02:00 CET jumps to 03:00 CEST, 02:30 does not exist
+    moment = localize(BERLIN, datetime(2026, 3, 29, 2, 30))
+    assert moment.replace(tzinfo=None) == datetime(2026, 3, 29, 3, 30)
+    assert moment.utcoffset() == timedelta(hours=2)
+
+
+def test_localize_fall_back():
+    # 2026-10-25 03:00 CEST goes back to 02:00 CET, 02:30 happens twice
+    moment = localize(BERLIN, datetime(2026, 10, 25, 2, 30))
+    assert moment.replace(tzinfo=None) == datetime(2026, 10, 25, 2, 30)
+    assert moment.utcoffset() == timedelta(hours=2)
+
+
+def test_next_local_time_across_spring_forward():
+    after = BERLIN.localize(datetime(2026, 3, 28, 12, 0))
+    due = next_local_time(2 * 60 + 30, BERLIN, after)
+    assert due.astimezone(pytz.utc) == datetime(2026, 3, 29, 1, 30, tzinfo=pytz.utc)
+
+
+def test_next_local_time_across_fall_back():
+    after = BERLIN.localize(datetime(2026, 10, 24, 12, 0))
+    due = next_local_time(2 * 60 + 30, BERLIN, after)
+    assert due.astimezone(pytz.utc) == datetime(2026, 10, 25, 0, 30, tzinfo=pytz.utc)
+    # The repeated 02:30 is not a second delivery the same day
+    following = next_local_time(2 * 60 + 30, BERLIN, due)
+    assert following.astimezone(pytz.utc) == datetime(2026, 10, 26, 1, 30, tzinfo=pytz.utc)
+
+
+def test_next_local_time_is_after():
+    after = BERLIN.localize(datetime(2026, 6, 1, 9, 0))
+    assert next_local_time(9 * 60, BERLIN, after) == BERLIN.localize(datetime(2026, 6, 2, 9, 0))
+    assert next_local_time(9 * 60 + 1, BERLIN, after) == BERLIN.localize(datetime(2026, 6, 1, 9, 1))
+
+
+def test_due_queue_buckets_by_minute():
+    queue = DueQueue()
+    queue.schedule(1, 1000)
+    queue.schedule(2, 1019)
+    queue.schedule(3, 1100)
+    assert queue.next_due() == 1020
+    assert queue.pop_due(1019) == []
+    assert sorted(queue.pop_due(1020)) == [1, 2]
+    assert queue.next_due() == 1140
+    assert len(queue) == 1
+
+
+def test_due_queue_cancel():
+    queue = DueQueue()
+    queue.schedule(1, 1000)
+    queue.schedule(2, 2000)
+    queue.cancel(1)
+    queue.cancel(1)
+    queue.cancel(42)
+    assert 1 not in queue
+    assert queue.due_time(1) is None
+    assert queue.next_due() == 2040
+    assert queue.pop_due(10000) == [2]
+    assert queue.next_due() is None
+    assert len(queue) == 0
+
+
+def test_due_queue_reschedule():
+    queue = DueQueue()
+    queue.schedule(1, 1000)
+    queue.schedule(2, 1000)
+    queue.schedule(1, 5000)
+    assert queue.due_time(1) == 5040
+    assert queue.pop_due(1020) == [2]
+    assert queue.pop_due(5039) == []
+    queue.schedule(1, 100)  # earlier than before
+    assert queue.next_due() == 120
+    assert queue.pop_due(120) == [1]
+    assert queue.pop_due(10000) == []
+
+
+def test_due_queue_compacts_cancelled_buckets():
+    queue = DueQueue()
+    for user_id in range(200):
+        queue.schedule(user_id, user_id * BUCKET_SECONDS)
+    for user_id in range(199):
+        queue.cancel(user_id)
+    assert len(queue._heap) <= 64 or len(queue._heap) <= 2 * len(queue._buckets)
+    assert queue.next_due() == 199 * BUCKET_SECONDS
+
+
+def test_failed_delivery_is_retried():
+    calls = []
+
+    async def deliver(user_ids):
+        calls.append(sorted(user_ids))
+        scheduler.schedule(1, time.time() + 86400)  # delivered before the failure
+        raise RuntimeError("store is locked")
+
+    async def run_once():
+        task = asyncio.ensure_future(scheduler.run())
+        while not calls:
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    scheduler = DeliveryScheduler(deliver, retry_delay=600)
+    scheduler.schedule(1, time.time() - 60)
+    scheduler.schedule(2, time.time() - 60)
+    asyncio.run(run_once())
+
+    assert calls == [[1, 2]]
+    assert scheduler.queue.due_time(1) > time.time() + 86000
+    assert time.time() + 500 < scheduler.queue.due_time(2) < time.time() + 700
@@ -0,0 +1,56 @@
+import json
+from datetime import datetime, timezone
+
+from user_store import JSON_LAYOUT_VERSION, SqliteUserStore
+
+
+def write_users_json(path):
+    data = {
+        'version': JSON_LAYOUT_VERSION,
+        'active_users': {'1': '2026-05-01T08:00:00+00:00', '2': None, '3': '2026-05-02T09:30:00'},
+        'user_lists': {'1': ['swear'], '3': ['swear', 'fenia'], '4': ['fenia']},
+        'rotations': {'1': [12345, 3, 4]},
+        'schedules': {'3': '07:30 Europe/Berlin'},
+    }
+    path.write_text(json.dumps(data))
+
+
+def test_migrate_from_json(tmp_path):
+    json_path = tmp_path / 'users.json'
+    write_users_json(json_path)
+    store = SqliteUserStore(str(tmp_path / 'users.db'), legacy_json=str(json_path))
+    state = store.load()
+    store.close()
+
+    assert state['active_users'] == {
+        1: datetime(2026, 5, 1, 8, 0, tzinfo=timezone.utc),
+        2: None,
+        3: datetime(2026, 5, 2, 9, 30, tzinfo=timezone.utc),  # naive times were written in UTC
+    }
+    # User 4 unsubscribed but kept their lists
+    assert state['user_lists'] == {1: ['swear'], 3: ['swear', 'fenia'], 4: ['fenia']}
+    assert state['rotations'] == {1: [12345, 3, 4]}
+    assert state['schedules'] == {3: '07:30 Europe/Berlin'}
+
+
+def test_migrate_from_json_runs_once(tmp_path):
+    json_path = tmp_path / 'users.json'
+    write_users_json(json_path)
+    db_path = str(tmp_path / 'users.db')
+    store = SqliteUserStore(db_path, legacy_json=str(json_path))
+    store.save_user(1, False, None, ['swear'])
+    store.close()
+
+    # The JSON file is left in place, reopening must not bring user 1 back
+    store = SqliteUserStore(db_path, legacy_json=str(json_path))
+    assert store.migrate_from_json(str(json_path)) == 0
+    state = store.load()
+    store.close()
+    assert 1 not in state['active_users']
+    assert state['user_lists'][1] == ['swear']
+
+
+def test_migrate_from_missing_json(tmp_path):
+    store = SqliteUserStore(str(tmp_path / 'users.db'), legacy_json=str(tmp_path / 'users.json'))
+    assert store.load() == {'active_users': {}, 'user_lists': {}, 'rotations': {}, 'schedules': {}}
+    store.close()
@@ -0,0 +1,143 @@
+"""Per-user rate limiting and coalescing of repeated updates.
+
+`ThrottlingMiddleware` sits in front of the dispatcher's handlers:
+
+* identical updates (same chat, same text or callback data) arriving
+  while the first one is still being handled are dropped, so a burst of
+  /skip taps costs one unit of work,
+* every user has a token bucket (`rate` updates/s, bursts of `burst`),
+* some commands additionally have a cooldown, e.g. one /skip per 30 s.
+
+Throttled users are told once per window when they may try again; the
+rest of their updates are dropped silently. Per-user state is a small
+slotted object in an LRU-ordered dict; users idle for `idle_ttl`
+seconds are evicted a few at a time on later calls.
+"""
+import logging
+import time
+from collections import OrderedDict
+
+from metrics import COALESCED_UPDATES, THROTTLED_UPDATES
+
+
+class _UserState:
+    __slots__ = ('tokens', 'updated', 'warned_until', 'next_allowed')
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+        self.warned_until = 0.0
+        self.next_allowed = None  # command -> monotonic time, for commands with a cooldown
+
+
+class UserThrottle:
+    """Token buckets and command cooldowns per user"""
+
+    def __init__(self, rate=1.0, burst=5, cooldowns=None, idle_ttl=600.0, evict_batch=8):
+        self.rate = rate
+        self.burst = burst
+        self.cooldowns = cooldowns or {}
+        self.idle_ttl = idle_ttl
+        self.evict_batch = evict_batch
+        self._users = OrderedDict()
+
+    def __len__(self):
+        return len(self._users)
+
+    def _evict_idle(self, now):
+        users = self._users
+        for _ in range(self.evict_batch):
+            if not users:
+                return
+            user_id, state = next(iter(users.items()))
+            if now - state.updated < self.idle_ttl:
+                return
+            del users[user_id]
+
+    def check(self, user_id, command=None, now=None):
+        """Take a token for one update; returns 0 if allowed, else seconds until it would be"""
+        now = time.monotonic() if now is None else now
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = _UserState(self.burst, now)
+        else:
+            self._users.move_to_end(user_id)
+            state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate)
+            state.updated = now
+        self._evict_idle(now)
+
+        cooldown = self.cooldowns.get(command)
+        if cooldown and state.next_allowed:
+            wait = state.next_allowed.get(command, 0.0) - now
+            if wait > 0:
+                return wait
+        if state.tokens < 1:
+            return (1 - state.tokens) / self.rate
+        state.tokens -= 1
+        if cooldown:
+            if state.next_allowed is None:
+                state.next_allowed = {}
+            state.next_allowed[command] = now + cooldown
+        return 0
+
+    def should_warn(self, user_id, wait, now=None):
+        """Whether to tell the user about throttling; once per throttled window"""
+        now = time.monotonic() if now is None else now
+        state = self._users.get(user_id)
+        if state is None or now < state.warned_until:
+            return False
+        state.warned_until = now + wait
+        return True
+
+
+def command_of(text):
+    """'/skip@my_bot now' -> 'skip', None for plain text"""
+    if not text or not text.startswith('/'):
+        return None
+    return text.split(maxsplit=1)[0][1:].split('@', 1)[0].lower()
+
+
+class ThrottlingMiddleware:
+    """Outer middleware for message and callback query observers"""
+
+    def __init__(self, throttle):
+        self.throttle = throttle
+        self._in_flight = set()
+
+    async def __call__(self, handler, event, data):
+        user = getattr(event, 'from_user', None)
+        if user is None:
+            return await handler(event, data)
+
+        payload = getattr(event, 'text', None)
+        if payload is None:
+            payload = getattr(event, 'data', None)
+        key = (user.id, payload)
+        if key in self._in_flight:
+            COALESCED_UPDATES.inc()
+            return None
+
+        command = command_of(payload) if hasattr(event, 'text') else None
+        wait = self.throttle.check(user.id, command)
+        if wait:
+            THROTTLED_UPDATES.inc(command=command or '')
+            if self.throttle.should_warn(user.id, wait):
+                await self._warn(event, wait)
+            return None
+
+        self._in_flight.add(key)
+        try:
+            return await handler(event, data)
+        finally:
+            self._in_flight.discard(key)
+
+    @staticmethod
+    async def _warn(event, wait):
+        text = f"⏳ Too fast! Try again in {max(1, round(wait))}s."
+        try:
+            if hasattr(event, 'reply'):
+                await event.reply(text)
+            else:
+                await event.answer(text)
+        except Exception as e:
+            logging.warning(f"Cannot send throttling notice: {e}")
@@ -0,0 +1,370 @@
+import copy
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import urllib.parse
+from datetime import datetime, timezone
+
+JSON_LAYOUT_VERSION = 2
+_MISSING = object()
+
+# Parts of a user record a change can touch, see UserStore.save_users
+ACTIVE = 'active'  # subscribed or not; also resets the last word time
+SENT = 'sent'  # last word time and rotation, only while subscribed
+LISTS = 'lists'
+SCHEDULE = 'schedule'
+
+
+def _parse_time(value):
+    """Parse a stored timestamp; naive ones were written in the container's UTC"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=timezone.utc)
+
+
+def _format_time(value):
+    return value.isoformat() if value else None
+
+
+def empty_state():
+    return {'active_users': {}, 'user_lists': {}, 'rotations': {}, 'schedules': {}}
+
+
+def read_json_users(path):
+    """Read a `version: 2` users.json file into the dicts returned by UserStore.load"""
+    with open(path, 'r') as file:
+        raw = file.read()
+    if not raw.strip():
+        return empty_state()
+    data = json.loads(raw)
+    users = {
+        int(user_id): _parse_time(last_word_time)
+        for user_id, last_word_time in data.get('active_users', {}).items()
+    }
+    user_lists = {
+        int(user_id): list(lists)
+        for user_id, lists in data.get('user_lists', {}).items()
+    }
+    rotations = {
+        int(user_id): rotation
+        for user_id, rotation in data.get('rotations', {}).items()
+    }
+    schedules = {
+        int(user_id): schedule
+        for user_id, schedule in data.get('schedules', {}).items()
+    }
+    return {'active_users': users, 'user_lists': user_lists, 'rotations': rotations, 'schedules': schedules}
+
+
+class UserStore:
+    """Base class for subscriber storage backends.
+
+    A user is described by whether they are subscribed (present in
+    `active_users`), the time of their last word, their selected lists
+    (`None` when they never picked any), their word rotation state per
+    list (see rotation.py) and their delivery schedule, a "HH:MM Area/City"
+    string (`None` for the default interval).
+
+    Stores with `supports_changes` can be shared by several processes and
+    implement `last_change` and `changes_since`.
+    """
+
+    supports_changes = False
+
+    def load(self):
+        """Return a dict of `active_users`, `user_lists`, `rotations` and `schedules` dicts keyed by user id"""
+        raise NotImplementedError
+
+    def save_user(self, user_id, active, last_word_time, lists, rotation=None, schedule=None):
+        """Persist a single user's record"""
+        raise NotImplementedError
+
+    def save_users(self, changes):
+        """Persist several users from (record, parts) pairs.
+
+        A record is a tuple of `save_user` arguments, `parts` the set of
+        ACTIVE, SENT, LISTS and SCHEDULE that changed. Stores shared between
+        processes write only those parts so they do not undo the others'
+        changes; the rest may write the whole record.
+        """
+        for record, _ in changes:
+            self.save_user(*record)
+
+    def last_change(self):
+        """Sequence number of the latest write, for `changes_since`; with `supports_changes` only"""
+        raise NotImplementedError
+
+    def changes_since(self, seq):
+        """Users written by any process after change `seq`, returns (state dict as in load, users, last seq)"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+# Every write takes the next sequence number, see SqliteUserStore.changes_since
+_NEXT_SEQ = "(SELECT COALESCE(MAX(seq), 0) + 1 FROM users)"
+_INSERT_VALUES = (
+    "(user_id, active, last_word_time, lists, rotation, schedule, seq)"
+    f" VALUES (?, ?, ?, ?, ?, ?, {_NEXT_SEQ})"
+)
+_INSERT_USER = f"INSERT INTO users {_INSERT_VALUES}"
+
+
+class SqliteUserStore(UserStore):
+    """SQLite backend in WAL mode, one row per user"""
+
+    supports_changes = True
+
+    def __init__(self, path, legacy_json=None):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Opened and loaded in a worker thread at startup, used only from the event loop after that
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            " user_id INTEGER PRIMARY KEY,"
+            " active INTEGER NOT NULL DEFAULT 1,"
+            " last_word_time TEXT,"
+            " lists TEXT,"
+            " rotation TEXT"
+            ")"
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(users)")}
+        if 'rotation' not in columns:
+            self.conn.execute("ALTER TABLE users ADD COLUMN rotation TEXT")
+        if 'schedule' not in columns:
+            self.conn.execute("ALTER TABLE users ADD COLUMN schedule TEXT")
+        if 'seq' not in columns:
+            # Write sequence number, lets processes sharing the database pick up each other's changes
+            self.conn.execute("ALTER TABLE users ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS users_seq ON users (seq)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        if legacy_json:
+            self.migrate_from_json(legacy_json)
+
+    def _get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def migrate_from_json(self, json_path):
+        """One-time import of a `version: 2` users.json file"""
+        if self._get_meta('migrated_from_json') or not os.path.exists(json_path):
+            return 0
+        try:
+            state = read_json_users(json_path)
+            users, user_lists, rotations = state['active_users'], state['user_lists'], state['rotations']
+            schedules = state['schedules']
+        except Exception as e:
+            logging.error(f"Cannot migrate {json_path}: {e}")
+            return 0
+
+        rows = [
+            (
+                user_id,
+                1 if user_id in users else 0,
+                _format_time(users.get(user_id)),
+                json.dumps(user_lists[user_id]) if user_id in user_lists else None,
+                json.dumps(rotations[user_id]) if user_id in rotations else None,
+                schedules.get(user_id),
+            )
+            for user_id in set(users) | set(user_lists)
+        ]
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO users (user_id, active, last_word_time, lists, rotation, schedule)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_json', ?)",
+                (datetime.now().isoformat(),),
+            )
+        logging.info(f"Migrated {len(rows)} users from {json_path} to {self.path}")
+        return len(rows)
+
+    @staticmethod
+    def _state_from_rows(rows):
+        state = empty_state()
+        for user_id, active, last_word_time, lists, rotation, schedule in rows:
+            if active:
+                state['active_users'][user_id] = _parse_time(last_word_time)
+            if lists is not None:
+                state['user_lists'][user_id] = json.loads(lists)
+            if rotation:
+                state['rotations'][user_id] = json.loads(rotation)
+            if schedule:
+                state['schedules'][user_id] = schedule
+        return state
+
+    def load(self):
+        return self._state_from_rows(self.conn.execute(
+            "SELECT user_id, active, last_word_time, lists, rotation, schedule FROM users"
+        ))
+
+    def last_change(self):
+        return self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM users").fetchone()[0]
+
+    def changes_since(self, seq):
+        rows = self.conn.execute(
+            "SELECT user_id, active, last_word_time, lists, rotation, schedule, seq FROM users"
+            " WHERE seq > ? ORDER BY seq",
+            (seq,),
+        ).fetchall()
+        if not rows:
+            return empty_state(), [], seq
+        return self._state_from_rows(row[:6] for row in rows), [row[0] for row in rows], rows[-1][6]
+
+    _SAVE_SQL = f"INSERT OR REPLACE INTO users {_INSERT_VALUES}"
+    # A new user's row is written whole, an existing one only in the changed columns
+    _UPSERT_SQL = {
+        ACTIVE: f"{_INSERT_USER} ON CONFLICT (user_id) DO UPDATE SET"
+                " active = excluded.active, last_word_time = excluded.last_word_time, seq = excluded.seq",
+        LISTS: f"{_INSERT_USER} ON CONFLICT (user_id) DO UPDATE SET lists = excluded.lists, seq = excluded.seq",
+        SCHEDULE: f"{_INSERT_USER} ON CONFLICT (user_id) DO UPDATE SET schedule = excluded.schedule, seq = excluded.seq",
+    }
+    # Never reactivates a user another process unsubscribed
+    _SENT_SQL = f"UPDATE users SET last_word_time = ?, rotation = ?, seq = {_NEXT_SEQ} WHERE user_id = ? AND active = 1"
+
+    @staticmethod
+    def _row(user_id, active, last_word_time, lists, rotation=None, schedule=None):
+        return (
+            user_id,
+            1 if active else 0,
+            _format_time(last_word_time),
+            json.dumps(lists) if lists is not None else None,
+            json.dumps(rotation, separators=(',', ':')) if rotation else None,
+            schedule,
+        )
+
+    def save_user(self, user_id, active, last_word_time, lists, rotation=None, schedule=None):
+        self.conn.execute(self._SAVE_SQL, self._row(user_id, active, last_word_time, lists, rotation, schedule))
+
+    def save_users(self, changes):
+        """Write the changed columns of several users in one transaction"""
+        with self.conn:
+            self.conn.execute("BEGIN")
+            for record, parts in changes:
+                row = self._row(*record)
+                for part in (ACTIVE, LISTS, SCHEDULE):
+                    if part in parts:
+                        self.conn.execute(self._UPSERT_SQL[part], row)
+                if SENT in parts:
+                    self.conn.execute(self._SENT_SQL, (row[2], row[4], row[0]))
+
+    def close(self):
+        self.conn.close()
+
+
+class JsonUserStore(UserStore):
+    """Legacy users.json backend.
+
+    Still rewrites the whole file on every change, but does so atomically
+    through a temporary file so a crash never leaves a truncated users.json.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.state = empty_state()
+        try:
+            self.state = read_json_users(path)
+        except FileNotFoundError:
+            logging.warning(f"{path} not found, creating new file")
+            self._write()
+
+    def load(self):
+        return copy.deepcopy(self.state)
+
+    def save_user(self, user_id, active, last_word_time, lists, rotation=None, schedule=None):
+        self._update(user_id, active, last_word_time, lists, rotation, schedule)
+        self._write()
+
+    def save_users(self, changes):
+        """Apply several records, then rewrite the file once"""
+        for record, _ in changes:
+            self._update(*record)
+        self._write()
+
+    def _update(self, user_id, active, last_word_time, lists, rotation=None, schedule=None):
+        fields = (
+            ('active_users', last_word_time if active else _MISSING),
+            ('user_lists', list(lists) if lists is not None else _MISSING),
+            ('rotations', rotation or _MISSING),
+            ('schedules', schedule or _MISSING),
+        )
+        for key, value in fields:
+            if value is _MISSING:
+                self.state[key].pop(user_id, None)
+            else:
+                self.state[key][user_id] = value
+
+    def _serializable(self):
+        return {
+            'active_users': {str(user_id): _format_time(t) for user_id, t in self.state['active_users'].items()},
+            'user_lists': {str(user_id): lists for user_id, lists in self.state['user_lists'].items()},
+            'rotations': {str(user_id): rotation for user_id, rotation in self.state['rotations'].items()},
+            'schedules': {str(user_id): schedule for user_id, schedule in self.state['schedules'].items()},
+            'version': JSON_LAYOUT_VERSION,
+        }
+
+    def _write(self):
+        data = self._serializable()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.users-', suffix='.json')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                json.dump(data, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # Bind-mounted files (see docker-compose.yml) cannot be replaced,
+            # fall back to rewriting in place.
+            os.unlink(tmp_path)
+            with open(self.path, 'w') as file:
+                json.dump(data, file)
+
+
+def parse_store_spec(spec, legacy_json='users.json'):
+    """`backend:path` -> (backend, path), e.g. `sqlite:users.db` or `json:users.json`"""
+    backend, _, path = spec.partition(':')
+    if backend == 'sqlite':
+        return backend, path or 'users.db'
+    if backend == 'json':
+        return backend, path or legacy_json
+    raise ValueError(f"Unknown user store backend '{backend}'")
+
+
+def open_user_store(spec, legacy_json='users.json'):
+    """Open a store from a `backend:path` spec"""
+    backend, path = parse_store_spec(spec, legacy_json)
+    if backend == 'sqlite':
+        return SqliteUserStore(path, legacy_json=legacy_json)
+    return JsonUserStore(path)
+
+
+def check_user_store(spec, legacy_json='users.json'):
+    """Read a store without creating or migrating anything; returns a short description, raises if unreadable"""
+    backend, path = parse_store_spec(spec, legacy_json)
+    if not os.path.exists(path):
+        return f"{path} does not exist yet and will be created"
+    if backend == 'sqlite':
+        conn = sqlite3.connect(f"file:{urllib.parse.quote(os.path.abspath(path))}?mode=ro", uri=True)
+        try:
+            result = conn.execute("PRAGMA quick_check").fetchone()[0]
+            if result != 'ok':
+                raise sqlite3.DatabaseError(result)
+            active = conn.execute("SELECT COUNT(*) FROM users WHERE active = 1").fetchone()[0]
+        finally:
+            conn.close()
+    else:
+        active = len(read_json_users(path)['active_users'])
+    return f"{path}: {active} active users"
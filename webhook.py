@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a sequence of numbers"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class WorkerPoolRequestHandler(SimpleRequestHandler):
+    """Webhook handler that queues updates for a fixed pool of worker tasks.
+
+    Telegram gets its 200 as soon as the update is queued; when the queue
+    is full it gets a 503 and delivers the update again later. Handler
+    latency (queue wait plus processing) is kept for the last
+    `latency_samples` updates.
+    """
+
+    def __init__(self, dispatcher, bot, workers=8, queue_size=1000, latency_samples=10000, **kwargs):
+        super().__init__(dispatcher, bot, handle_in_background=True, **kwargs)
+        self.workers = workers
+        self.queue_size = queue_size
+        self.latencies = deque(maxlen=latency_samples)
+        self.handled = 0
+        self._queue = None
+        self._worker_tasks = []
+
+    def register(self, app, /, path, **kwargs):
+        app.on_startup.append(self._start_workers)
+        super().register(app, path=path, **kwargs)
+        app.router.add_route("GET", f"{path}/stats", self.handle_stats)
+
+    async def _start_workers(self, app):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logging.info(f"Started {self.workers} webhook workers")
+
+    async def _worker(self):
+        while True:
+            bot, update, received = await self._queue.get()
+            try:
+                await self._background_feed_update(bot=bot, update=update)
+            except Exception as e:
+                logging.error(f"Error handling update {update.get('update_id')}: {e}")
+            finally:
+                self.latencies.append(time.perf_counter() - received)
+                self.handled += 1
+                self._queue.task_done()
+
+    async def _handle_request_background(self, bot, request):
+        update = await request.json(loads=bot.session.json_loads)
+        try:
+            self._queue.put_nowait((bot, update, time.perf_counter()))
+        except asyncio.QueueFull:
+            logging.warning("Webhook queue is full, asking Telegram to retry")
+            return web.Response(status=503)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def handle_stats(self, request):
+        """Handler latency percentiles, protected by the same secret token"""
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), self.bot):
+            return web.Response(body="Unauthorized", status=401)
+        samples = list(self.latencies)
+        return web.json_response({
+            "handled": self.handled,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "p50": percentile(samples, 0.50),
+            "p99": percentile(samples, 0.99),
+        })
+
+    async def close(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        await super().close()
+
+
+async def run_webhook(dispatcher, bot, secret_token, path="/webhook", host="0.0.0.0", port=8080,
+                      public_url=None, workers=8):
+    """Serve updates over a webhook until cancelled"""
+    if not secret_token:
+        raise ValueError("WEBHOOK_SECRET must be set in webhook mode")
+
+    app = web.Application()
+    handler = WorkerPoolRequestHandler(dispatcher, bot, workers=workers, secret_token=secret_token)
+    handler.register(app, path=path)
+    setup_application(app, dispatcher, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logging.info(f"Webhook server listening on {host}:{port}{path}")
+
+    if public_url:
+        await bot.set_webhook(
+            f"{public_url.rstrip('/')}{path}",
+            secret_token=secret_token,
+            drop_pending_updates=True,
+        )
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,234 @@
+import logging
+import os
+import time
+from array import array
+
+from entries import FIELDS, TSV_EXTENSION, format_record, language_key, parse_line, read_tsv
+from metrics import WORDLIST_LOAD_SECONDS
+from search import WordIndex
+from wordpack import PackedWordList, compile_wordlist, is_fresh, pack_path
+
+
+class WordList:
+    """Immutable, index-addressable contents of one word list file.
+
+    `words` is a tuple, or a PackedWordList that decodes entries on access.
+    Structured fields (see entries.py) are kept as one tuple per field;
+    they come from the file for `.tsv` lists. Plain lists parse a single
+    line per `record()` and build the columns only for `languages()`.
+    """
+
+    __slots__ = ('name', 'words', 'mtime_ns', 'size', 'version', '_sorted_ids', '_index', '_columns', '_languages')
+
+    def __init__(self, name, words, mtime_ns=0, size=0, version=0, records=None):
+        self.name = name
+        self.words = words if isinstance(words, PackedWordList) else tuple(words)
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.version = version
+        self._sorted_ids = None
+        self._index = None
+        self._columns = self._make_columns(records) if records is not None else None
+        self._languages = None
+
+    def __len__(self):
+        return len(self.words)
+
+    def __getitem__(self, index):
+        return self.words[index]
+
+    @staticmethod
+    def _make_columns(records):
+        columns = {field: [] for field in FIELDS}
+        interned = {}
+        for record in records:
+            for field, value in zip(FIELDS, record):
+                columns[field].append(interned.setdefault(value, value) if field == 'language' else value)
+        return {field: tuple(values) for field, values in columns.items()}
+
+    @property
+    def columns(self):
+        """Per-field tuples of the structured entries"""
+        if self._columns is None:
+            self._columns = self._make_columns(parse_line(word) for word in self.words)
+        return self._columns
+
+    def record(self, index):
+        """Structured fields of one entry as a tuple in FIELDS order"""
+        columns = self._columns
+        if columns is None:
+            return parse_line(self.words[index])
+        return tuple(columns[field][index] for field in FIELDS)
+
+    @property
+    def sorted_ids(self):
+        """Entry indices in sorted word order, computed once per loaded version"""
+        if self._sorted_ids is None:
+            self._sorted_ids = array('I', sorted(range(len(self.words)), key=self.words.__getitem__))
+        return self._sorted_ids
+
+    @property
+    def index(self):
+        """Search index over the words, built on first use per loaded version"""
+        if self._index is None:
+            self._index = WordIndex(self.words)
+        return self._index
+
+    def languages(self):
+        """{language key: (display name, entry indices in sorted order)}"""
+        if self._languages is None:
+            languages = {}
+            language_column = self.columns['language']
+            for i in self.sorted_ids:
+                language = language_column[i]
+                if language:
+                    key = language_key(language)
+                    languages.setdefault(key, (language, array('I')))[1].append(i)
+            self._languages = dict(sorted(languages.items()))
+        return self._languages
+
+    def _view(self, language=None):
+        if language is None:
+            return self.sorted_ids
+        entry = self.languages().get(language_key(language))
+        return entry[1] if entry else ()
+
+    def page_count(self, page_size, language=None):
+        return max(1, -(-len(self._view(language)) // page_size))
+
+    def page(self, number, page_size, language=None):
+        """Words on a zero-based page of the sorted list, optionally of one language only"""
+        start = number * page_size
+        return tuple(self.words[i] for i in self._view(language)[start:start + page_size])
+
+
+def read_wordlist_file(path):
+    """Read a text word list, one entry per non-empty line"""
+    with open(path, 'r', encoding='utf-8') as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def load_entries(path, mtime_ns, size, use_packs=True):
+    """Entries of a word list file, memory-mapped from its compiled pack when possible.
+
+    A missing or stale pack is recompiled first; if that fails (e.g. on a
+    read-only directory) the text file is parsed instead.
+    """
+    if not use_packs:
+        return read_wordlist_file(path)
+    pack = pack_path(path)
+    if not is_fresh(pack, mtime_ns, size):
+        try:
+            compile_wordlist(path, pack)
+        except OSError as e:
+            logging.warning(f"Cannot compile {path}: {e}")
+            return read_wordlist_file(path)
+    return PackedWordList(pack)
+
+
+class WordListRegistry:
+    """Word lists from a directory, each parsed on first use and reloaded when its file changes.
+
+    The directory is re-scanned at most every `check_interval` seconds;
+    `names()` and `version` only need the scan, so listing the available
+    lists never parses one. A changed file is parsed into a new WordList
+    object that is swapped in as a whole, so readers never see a
+    half-loaded list.
+    """
+
+    def __init__(self, directory, check_interval=2.0, extensions=('.txt', '.tsv'), use_packs=True):
+        self.directory = directory
+        self.use_packs = use_packs
+        self.check_interval = check_interval
+        self.extensions = extensions
+        self.version = 0
+        self._found = {}
+        self._lists = {}
+        self._names = ()
+        self._last_check = None
+
+    def _scan(self):
+        """{name: (path, mtime_ns, size)}, a structured `.tsv` file wins over a plain one of the same name"""
+        found = {}
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    name, ext = os.path.splitext(entry.name)
+                    if ext not in self.extensions or not entry.is_file():
+                        continue
+                    if name in found and ext != TSV_EXTENSION:
+                        continue
+                    stat = entry.stat()
+                    found[name] = (entry.path, stat.st_mtime_ns, stat.st_size)
+        except OSError as e:
+            logging.error(f"Error reading wordlists directory: {e}")
+        return found
+
+    def refresh(self, force=False):
+        """Re-scan the directory, returns whether list files were added, changed or removed"""
+        now = time.monotonic()
+        if not force and self._last_check is not None and now - self._last_check < self.check_interval:
+            return False
+        self._last_check = now
+
+        found = self._scan()
+        if found == self._found:
+            return False
+        self._found = found
+        self._lists = {name: word_list for name, word_list in self._lists.items() if name in found}
+        self._names = tuple(sorted(found))
+        self.version += 1
+        return True
+
+    def _load(self, name, path, mtime_ns, size):
+        try:
+            started = time.perf_counter()
+            if path.endswith(TSV_EXTENSION):
+                records = read_tsv(path)
+                words = [format_record(record) for record in records]
+            else:
+                records = None
+                words = load_entries(path, mtime_ns, size, self.use_packs)
+            word_list = WordList(name, words, mtime_ns, size, self.version, records)
+            elapsed = time.perf_counter() - started
+            WORDLIST_LOAD_SECONDS.observe(elapsed, list=name)
+            logging.info(f"Loaded word list '{name}': {len(words)} words in {elapsed:.3f}s")
+            return word_list
+        except Exception as e:
+            logging.error(f"Error reading word list '{name}': {e}")
+            return None
+
+    def names(self):
+        self.refresh()
+        return self._names
+
+    def inspect(self, name):
+        """(entries, whether its pack is up to date) of a list, read from its file without compiling or keeping it.
+
+        Raises for an unreadable file. `.tsv` lists have no pack and report True.
+        """
+        self.refresh()
+        path, mtime_ns, size = self._found[name]
+        if path.endswith(TSV_EXTENSION):
+            return len(read_tsv(path)), True
+        fresh = not self.use_packs or is_fresh(pack_path(path), mtime_ns, size)
+        return len(read_wordlist_file(path)), fresh
+
+    def get(self, name):
+        """The named list, parsed now if it was not yet or its file changed; None if missing or unreadable"""
+        self.refresh()
+        found = self._found.get(name)
+        if found is None:
+            return None
+        current = self._lists.get(name)
+        if current is not None and (current.mtime_ns, current.size) == found[1:]:
+            return current
+        word_list = self._load(name, *found)
+        if word_list is None:
+            return current  # keep serving the last good version
+        self._lists[name] = word_list
+        return word_list
+
+    def __contains__(self, name):
+        self.refresh()
+        return name in self._found
@@ -0,0 +1,125 @@
+"""Compiled, memory-mapped word lists.
+
+A `.wlp` file holds a header, an offsets table and the packed UTF-8 bytes
+of every entry:
+
+    magic 'WLP1' | uint32 count | int64 source mtime_ns | uint64 source size
+    uint32 offsets[count + 1]
+    entry bytes
+
+All integers are little-endian. Reading entry `i` decodes only
+`data[offsets[i]:offsets[i + 1]]`, and every process mapping the same file
+shares one page-cached copy.
+
+    python wordpack.py wordlists/*.txt
+"""
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+
+MAGIC = b'WLP1'
+HEADER = struct.Struct('<4sIqQ')
+PACK_EXTENSION = '.wlp'
+
+
+def pack_path(text_path):
+    return os.path.splitext(text_path)[0] + PACK_EXTENSION
+
+
+def _entries(text_path):
+    with open(text_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            entry = line.strip()
+            if entry:
+                yield entry.encode('utf-8')
+
+
+def compile_wordlist(text_path, output_path=None):
+    """Compile a text word list into a `.wlp` file next to it, returns the output path"""
+    output_path = output_path or pack_path(text_path)
+    stat = os.stat(text_path)
+
+    # First pass: entry sizes, so the offsets table can precede the data
+    offsets = array('I', [0])
+    for entry in _entries(text_path):
+        offsets.append(offsets[-1] + len(entry))
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output_path)), suffix=PACK_EXTENSION)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, len(offsets) - 1, stat.st_mtime_ns, stat.st_size))
+            file.write(offsets.tobytes())
+            for entry in _entries(text_path):
+                file.write(entry)
+        os.chmod(tmp_path, 0o644)  # mkstemp creates 0600, packs are read by other users like the text lists
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return output_path
+
+
+def read_header(path):
+    """Return (count, source mtime_ns, source size) of a `.wlp` file, or None if invalid"""
+    try:
+        with open(path, 'rb') as file:
+            magic, count, mtime_ns, size = HEADER.unpack(file.read(HEADER.size))
+    except (OSError, struct.error):
+        return None
+    return (count, mtime_ns, size) if magic == MAGIC else None
+
+
+def is_fresh(pack, mtime_ns, size):
+    """Whether a `.wlp` file was compiled from a text file with this mtime and size"""
+    header = read_header(pack)
+    return header is not None and header[1:] == (mtime_ns, size)
+
+
+class PackedWordList:
+    """Read-only sequence of entries backed by a memory-mapped `.wlp` file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, _, _ = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a compiled word list")
+        table_end = HEADER.size + 4 * (self._count + 1)
+        if sys.byteorder == 'little':
+            self._offsets = memoryview(self._mmap)[HEADER.size:table_end].cast('I')
+        else:
+            self._offsets = array('I', self._mmap[HEADER.size:table_end])
+            self._offsets.byteswap()
+        self._data_start = table_end
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self[i] for i in range(*index.indices(self._count)))
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("word index out of range")
+        start = self._data_start + self._offsets[index]
+        end = self._data_start + self._offsets[index + 1]
+        return self._mmap[start:end].decode('utf-8')
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit(f"Usage: {sys.argv[0]} <wordlist.txt>...")
+    for text_path in sys.argv[1:]:
+        output_path = compile_wordlist(text_path)
+        print(f"{text_path} -> {output_path} ({read_header(output_path)[0]} entries)")